@@ -0,0 +1,161 @@
+from typing import Any, Dict, List, Iterable, Optional
+import hashlib
+from functools import wraps
+
+from django.core.cache import cache
+from django.utils.cache import patch_response_headers
+from django.views.decorators.cache import cache_page
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
+from rest_framework.fields import SkipField
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+from helpers.cache import get_generations
+
+
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+
+class FragmentCacheMixin:
+    """A serializer mixin that caches the representation of each instance it
+    renders, keyed by serializer class, pk, `modified` and field set. Changing
+    a record bumps `modified`, so cached fragments are never stale.
+
+    Only serializers nested inside a root serializer that warms the cache, i.e.
+    `FragmentCacheListSerializer` or `FragmentCacheRootMixin`, use the cache.
+    Root fetches all fragments it needs with one `get_many`, and stores the
+    ones it had to render with one `set_many`.
+    """
+    fields: Dict[str, Any]  # provided by serializer
+    _fragments: Optional[Dict[str, Any]] = None
+    _fragments_missed: Optional[Dict[str, Any]] = None
+    _fragment_fields: Optional[str] = None
+
+    def fragment_key(self, instance) -> str:
+        if self._fragment_fields is None:
+            fields = ','.join(sorted(self.fields.keys()))
+            self._fragment_fields = hashlib.md5(fields.encode()).hexdigest()[:10]
+        return 'fragment:{}:{}:{}:{}'.format(
+            self.__class__.__name__, instance.pk, instance.modified.timestamp(), self._fragment_fields,
+        )
+
+    def to_representation(self, instance):
+        if self._fragments is None or instance.pk is None or instance.modified is None:
+            return super().to_representation(instance)
+        key = self.fragment_key(instance)
+        if key in self._fragments:
+            return self._fragments[key]
+        data = super().to_representation(instance)
+        self._fragments[key] = data
+        self._fragments_missed[key] = data
+        return data
+
+
+def related_instances(field, instances) -> List[Any]:
+    related: List[Any] = []
+    for instance in instances:
+        try:
+            attribute = field.get_attribute(instance)
+        except (AttributeError, KeyError, ObjectDoesNotExist, SkipField):
+            continue
+        if attribute is None:
+            continue
+        if isinstance(field, ListSerializer):
+            related.extend(attribute.all() if isinstance(attribute, models.Manager) else attribute)
+        else:
+            related.append(attribute)
+    return related
+
+
+def collect_fragments(serializer, instances, found: Dict) -> Dict:
+    """Walk nested serializers, collecting instances to be rendered by each
+    fragment cached serializer.
+    """
+    if isinstance(serializer, FragmentCacheMixin):
+        found.setdefault(serializer, []).extend(instances)
+        return found
+
+    for field in serializer.fields.values():
+        if not isinstance(field, BaseSerializer):
+            continue
+        nested = field.child if isinstance(field, ListSerializer) else field
+        collect_fragments(nested, related_instances(field, instances), found)
+    return found
+
+
+def warm_fragments(serializer, instances) -> List[FragmentCacheMixin]:
+    keys: Dict[str, Dict[str, Any]] = {}  # fragment key -> fragments of serializer that renders it
+    found = collect_fragments(serializer, instances, {})
+    for fragment_serializer, fragment_instances in found.items():
+        fragments: Dict[str, Any] = {}
+        fragment_serializer._fragments = fragments
+        fragment_serializer._fragments_missed = {}
+        for instance in fragment_instances:
+            if instance.pk is not None and instance.modified is not None:
+                keys[fragment_serializer.fragment_key(instance)] = fragments
+
+    if keys:
+        for key, data in cache.get_many(list(keys)).items():
+            keys[key][key] = data
+    return list(found)
+
+
+def flush_fragments(serializers: List[FragmentCacheMixin]) -> None:
+    missed: Dict[str, Any] = {}
+    for serializer in serializers:
+        missed.update(serializer._fragments_missed or {})
+        serializer._fragments = None
+        serializer._fragments_missed = None
+    if missed:
+        cache.set_many(missed, FRAGMENT_TIMEOUT)
+
+
+class FragmentCacheListSerializer(ListSerializer):
+    """Set as `list_serializer_class` of a serializer to warm fragment cache for
+    whole list when it's the root serializer.
+    """
+    def to_representation(self, data):
+        if self.parent is not None:
+            return super().to_representation(data)
+        instances = list(data.all() if isinstance(data, models.Manager) else data)
+        serializers = warm_fragments(self.child, instances)
+        representation = super().to_representation(instances)
+        flush_fragments(serializers)
+        return representation
+
+
+class FragmentCacheRootMixin:
+    """Warms fragment cache when serializer is used to render a single instance.
+    """
+    def to_representation(self, instance):
+        if self.parent is not None:
+            return super().to_representation(instance)
+        serializers = warm_fragments(self, [instance])
+        representation = super().to_representation(instance)
+        flush_fragments(serializers)
+        return representation
+
+
+def cache_page_versioned(timeout: int, resources: Iterable[str], max_age: int = 30):
+    """Like `cache_page`, but key prefix includes current generation of each of
+    `resources`. Saving or deleting a record bumps generation of its model (see
+    `db.map.models.bump_model_generation`), so cached responses are valid until
+    data they depend on actually changes, and `timeout` can be long.
+
+    Clients and CDN don't see invalidations, so `Cache-Control: max-age` is set
+    to `max_age` instead of `timeout`.
+    """
+    resources = tuple(resources)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            key_prefix = 'v{}'.format('.'.join(str(g) for g in get_generations(resources)))
+            response = cache_page(timeout, key_prefix=key_prefix)(view)(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD') and response.status_code == 200:
+                if response.has_header('Expires'):
+                    del response['Expires']
+                patch_response_headers(response, max_age)
+            return response
+        return wrapped
+    return decorator
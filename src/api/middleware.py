@@ -0,0 +1,164 @@
+from typing import Any, Dict, List
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+
+
+logger = logging.getLogger('api.profiling')
+
+METRICS_SAMPLES = 1000
+METRICS_FIELDS = ('requests', 'queries', 'db_ms', 'serialize_ms', 'render_ms', 'total_ms', 'bytes', 'over_budget')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def metrics_key(*parts: str) -> str:
+    return cache.make_key(':'.join(('metrics',) + parts))
+
+
+def record_metrics(record: Dict[str, Any]) -> None:
+    """Add request's numbers to totals for its view in Redis, and keep a sample
+    of its latency for percentiles.
+    """
+    view = record['view']
+    redis = get_redis_connection('default')
+    pipeline = redis.pipeline(transaction=False)
+    pipeline.sadd(metrics_key('views'), view)
+    totals = metrics_key('totals', view)
+    pipeline.hincrby(totals, 'requests', 1)
+    pipeline.hincrby(totals, 'over_budget', int(record['over_budget']))
+    for field in ('queries', 'bytes'):
+        pipeline.hincrby(totals, field, record[field] or 0)
+    for field in ('db_ms', 'serialize_ms', 'render_ms', 'total_ms'):
+        pipeline.hincrbyfloat(totals, field, record[field] or 0)
+    samples = metrics_key('samples', view)
+    pipeline.lpush(samples, json.dumps([record['total_ms'], record['queries']]))
+    pipeline.ltrim(samples, 0, METRICS_SAMPLES - 1)
+    pipeline.execute()
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+def get_metrics() -> Dict[str, Dict[str, Any]]:
+    """Mean of each metric, p50 and p95 latency and max queries per view, over
+    all workers since last reset.
+    """
+    redis = get_redis_connection('default')
+    metrics = {}
+    for view in sorted(v.decode() for v in redis.smembers(metrics_key('views'))):
+        totals = {k.decode(): float(v) for k, v in redis.hgetall(metrics_key('totals', view)).items()}
+        samples = [json.loads(s) for s in redis.lrange(metrics_key('samples', view), 0, -1)]
+        requests = totals.get('requests') or 1
+        metrics[view] = {
+            'requests': int(totals.get('requests', 0)),
+            'over_budget': int(totals.get('over_budget', 0)),
+            **{f'mean_{field}': round(totals.get(field, 0) / requests, 2) for field in METRICS_FIELDS[1:-1]},
+            'p50_total_ms': percentile([s[0] for s in samples], 0.5),
+            'p95_total_ms': percentile([s[0] for s in samples], 0.95),
+            'max_queries': max((s[1] for s in samples), default=0),
+        }
+    return metrics
+
+
+def reset_metrics() -> None:
+    redis = get_redis_connection('default')
+    views = [v.decode() for v in redis.smembers(metrics_key('views'))]
+    keys = [metrics_key(kind, view) for view in views for kind in ('totals', 'samples')]
+    redis.delete(metrics_key('views'), *keys)
+
+
+class ProfilingMiddleware:
+    """Opt-in with `PROFILING` setting. Records SQL query count, DB time, time
+    spent in view outside DB (mostly serialization), render time and response
+    size of each request. Logs them as JSON to `api.profiling` logger, and
+    aggregates them by view in Redis, see `/internal/metrics/`.
+
+    Views can declare `query_budget`, max number of queries run by view, i.e.
+    after `process_view` and before response is rendered, so not counting
+    ones run by other middleware, e.g. to load session. Going over budget is
+    logged, and raises `QueryBudgetExceeded` if `QUERY_BUDGET_ENFORCE` setting
+    is on, e.g. in development. For responses that aren't rendered, e.g. a
+    plain `HttpResponse`, view's queries are all the ones after `process_view`.
+
+    Queries run while a `StreamingHttpResponse` is consumed aren't counted.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._profiling = {'view': None}
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as context:
+            request._profiling['context'] = context
+            response = self.get_response(request)
+        end = time.perf_counter()
+
+        profiling = request._profiling
+        if profiling['view'] is None:
+            return response
+        queries = context.captured_queries
+        view_start = profiling.get('view_start', start)
+        view_end = profiling.get('view_end', end)
+        view_queries = queries[profiling.get('view_query_start', 0):profiling.get('view_query_end', len(queries))]
+        view_db_ms = sum(float(q['time']) for q in view_queries) * 1000
+
+        budget = getattr(profiling['view_class'], 'query_budget', None)
+        record = {
+            'view': profiling['view'],
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': len(view_queries),
+            'request_queries': len(queries),
+            'query_budget': budget,
+            'over_budget': budget is not None and len(view_queries) > budget,
+            'db_ms': round(sum(float(q['time']) for q in queries) * 1000, 2),
+            'serialize_ms': round(max((view_end - view_start) * 1000 - view_db_ms, 0), 2),
+            'render_ms': round((profiling.get('render_end', view_end) - view_end) * 1000, 2),
+            'total_ms': round((end - start) * 1000, 2),
+            'bytes': None if response.streaming else len(response.content),
+        }
+        logger.info(json.dumps(record))
+        try:
+            record_metrics(record)
+        except Exception:
+            logger.exception('failed to record metrics')
+
+        if record['over_budget']:
+            message = f"{record['view']} ran {record['queries']} queries, budget is {budget}"
+            logger.warning(message)
+            if getattr(settings, 'QUERY_BUDGET_ENFORCE', False):
+                raise QueryBudgetExceeded(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        profiling = request._profiling
+        profiling['view_class'] = view_class
+        profiling['view'] = view_class.__name__ if view_class else getattr(view_func, '__name__', 'unknown')
+        profiling['view_start'] = time.perf_counter()
+        profiling['view_query_start'] = len(profiling['context'].captured_queries)
+
+    def process_template_response(self, request, response):
+        profiling = request._profiling
+        profiling['view_end'] = time.perf_counter()
+        profiling['view_query_end'] = len(profiling['context'].captured_queries)
+
+        def render_end(response):
+            profiling['render_end'] = time.perf_counter()
+        response.add_post_render_callback(render_end)
+        return response
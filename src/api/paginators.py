@@ -1,17 +1,54 @@
+from typing import Any, List, Optional, Tuple
+import base64
+import binascii
+import json
 import sys
 from collections import OrderedDict
 
+from django.core.exceptions import ValidationError
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps([str(v) for v in values]).encode()).decode()
+
+
+def decode_cursor(cursor: str, fields: List[Any]) -> List[Any]:
+    """Raises `NotFound` if cursor can't be decoded into a value for each of
+    `fields`, like DRF's `CursorPagination`.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except (binascii.Error, UnicodeError, ValueError, TypeError, ValidationError):
+        raise NotFound('Invalid cursor')
 
 
 class NoCountPagination(LimitOffsetPagination):
     """Ensures Django doesn't call `count` on queryset, because counting records
     in large tables can be very expensive, especially with PostgreSQL.
+
+    Fetches one extra record to know if there's a next page.
+
+    If view has `keyset_ordering`, e.g. `('-created', '-id')`, passing `cursor`
+    in query string (empty for first page) switches to keyset pagination: each
+    page starts after last record of previous page, instead of at an offset,
+    so deep pages are as fast as first page if there's an index on ordering
+    fields. Last field must be unique. Keyset pagination only has `next` links.
     """
     default_limit = 100
     limit_query_param = 'page_size'
     max_limit = 2000
+    cursor_query_param = 'cursor'
+
+    keyset: Optional[Tuple[str, ...]] = None
+    has_next = False
+    last = None
 
     def paginate_queryset(self, queryset, request, view=None):
         # https://github.com/encode/django-rest-framework/blob/master/rest_framework/pagination.py
@@ -20,14 +57,58 @@ class NoCountPagination(LimitOffsetPagination):
         if self.limit is None:
             return None
 
-        self.offset = self.get_offset(request)
         self.request = request
+        keyset = getattr(view, 'keyset_ordering', None)
+        if keyset and self.cursor_query_param in request.query_params:
+            self.keyset = keyset
+            return self.paginate_queryset_keyset(queryset, keyset, request.query_params[self.cursor_query_param])
+        self.keyset = None
+
+        self.offset = self.get_offset(request)
         if self.count > self.limit and self.template is not None:
             self.display_page_controls = True
 
-        if self.count == 0 or self.offset > self.count:
-            return []
-        return list(queryset[self.offset:self.offset + self.limit])
+        results = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(results) > self.limit
+        return results[:self.limit]
+
+    def paginate_queryset_keyset(self, queryset, keyset: Tuple[str, ...], cursor: str):
+        descending = {f.startswith('-') for f in keyset}
+        assert len(descending) == 1, 'keyset_ordering fields must all be ascending or all descending'
+        names = [f.lstrip('-') for f in keyset]
+        opts = queryset.model._meta
+        fields = [opts.get_field(name) for name in names]
+
+        queryset = queryset.order_by(*keyset)
+        if cursor:
+            # row comparison lets Postgres seek directly to start of page in composite index
+            columns = ', '.join(f'"{opts.db_table}"."{field.column}"' for field in fields)
+            placeholders = ', '.join(['%s'] * len(fields))
+            operator = '<' if descending.pop() else '>'
+            queryset = queryset.extra(
+                where=[f'({columns}) {operator} ({placeholders})'], params=decode_cursor(cursor, fields),
+            )
+
+        results = list(queryset[:self.limit + 1])
+        self.has_next = len(results) > self.limit
+        results = results[:self.limit]
+        self.last = [getattr(results[-1], field.attname) for field in fields] if results else None
+        return results
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.keyset:
+            return super().get_next_link()
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(self.last))
+
+    def get_previous_link(self):
+        if self.keyset:
+            return None
+        return super().get_previous_link()
 
     def get_paginated_response(self, data):
         return Response(OrderedDict([
@@ -0,0 +1,132 @@
+from typing import Any, Dict, List, Sequence
+
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+import msgpack
+
+
+COLUMNAR_VERSION = 1
+COLUMNAR_DICTIONARY_FIELDS = (
+    'state_name', 'municipality_name', 'locality.state_name', 'locality.municipality_name',
+)
+
+
+def flatten(row: Dict[str, Any], prefix: str = '') -> Dict[str, Any]:
+    """Nested objects become dotted columns, e.g. `{'location': {'lat': 1}}` -> `{'location.lat': 1}`.
+    Empty objects add no columns.
+    """
+    flat: Dict[str, Any] = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def to_columnar(rows: Sequence[Dict[str, Any]], dictionary_fields: Sequence[str] = ()) -> Dict[str, Any]:
+    """Transpose `rows` into one array per column. Strings in `dictionary_fields`
+    columns are replaced by their index in `dictionaries[column]`.
+    """
+    flat_rows = [flatten(row) for row in rows]
+    columns: Dict[str, None] = {}  # dict rather than set to keep order of first appearance
+    for row in flat_rows:
+        for column in row:
+            columns.setdefault(column)
+
+    data: List[List[Any]] = []
+    dictionaries: Dict[str, List[str]] = {}
+    for column in columns:
+        values = [row.get(column) for row in flat_rows]
+        if column in dictionary_fields:
+            indices: Dict[Any, int] = {}
+            values = [None if v is None else indices.setdefault(v, len(indices)) for v in values]
+            dictionaries[column] = list(indices)
+        data.append(values)
+    return {
+        'format': 'columnar',
+        'version': COLUMNAR_VERSION,
+        'count': len(flat_rows),
+        'columns': list(columns),
+        'data': data,
+        'dictionaries': dictionaries,
+    }
+
+
+def columnar_data(data: Any, renderer_context: Dict[str, Any]) -> Any:
+    """Paginated data and lists are rendered in columns; anything else, e.g. an
+    error, is rendered as is.
+    """
+    response = renderer_context.get('response')
+    if response is not None and response.exception:
+        return data
+    dictionary_fields = getattr(renderer_context.get('view'), 'columnar_dictionary_fields', COLUMNAR_DICTIONARY_FIELDS)
+    if isinstance(data, list):
+        return to_columnar(data, dictionary_fields)
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        extra = {k: v for k, v in data.items() if k != 'results'}
+        return {**to_columnar(data['results'], dictionary_fields), **extra}
+    return data
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """Opt-in with `?format=columnar`. Bulk lists are mostly repeated key names,
+    so rows are sent as one array per column instead:
+
+        {
+            "format": "columnar",
+            "version": 1,
+            "count": 2,
+            "columns": ["id", "location.lng", "location.lat", "state_name"],
+            "data": [[1, 2], [-99.1, -98.2], [19.4, 19.0], [0, 0]],
+            "dictionaries": {"state_name": ["Puebla"]},
+            "next": null,
+            "previous": null
+        }
+
+    `data[i]` holds values of `columns[i]`, one per row. Nested objects are
+    flattened into dotted columns, and objects missing a key have `null` in
+    its column. Values of columns in `dictionaries`, e.g. state and
+    municipality names, are indices into that column's dictionary. Other keys
+    of paginated responses are kept as they are.
+    """
+    format = 'columnar'
+    format_only = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(columnar_data(data, renderer_context or {}), accepted_media_type, renderer_context)
+
+
+class MsgpackRenderer(BaseRenderer):
+    """Opt-in with `?format=msgpack`. Same payload as `ColumnarJSONRenderer`,
+    encoded with MessagePack, which is smaller and faster to decode than JSON.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    format_only = True
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # dates, decimals, etc. are encoded the same way as in JSON
+        encoder = JSONEncoder()
+        return msgpack.packb(columnar_data(data, renderer_context or {}), use_bin_type=True, default=encoder.default)
+
+
+class FormatOnlyContentNegotiation(DefaultContentNegotiation):
+    """Renderers with `format_only` are only chosen with `?format=`, never by
+    `Accept` header. Responses are cached by URL, without `Vary: Accept`, so
+    otherwise one client asking for msgpack would fill cache with msgpack for
+    every JSON client.
+    """
+    def select_renderer(self, request, renderers, format_suffix=None):
+        if not (format_suffix or request.query_params.get(self.settings.URL_FORMAT_OVERRIDE)):
+            renderers = [r for r in renderers if not getattr(r, 'format_only', False)]
+        return super().select_renderer(request, renderers, format_suffix)
+
+
+COLUMNAR_RENDERER_CLASSES = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (ColumnarJSONRenderer, MsgpackRenderer)
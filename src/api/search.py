@@ -0,0 +1,236 @@
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from array import array
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+
+from django.db import connection
+
+from helpers.cache import get_generations
+
+
+# same weights as `locality_search_index.document`, and `ts_rank` weights for A and B
+NAME_WEIGHT = 1.0
+MUNICIPALITY_WEIGHT = 0.4
+STATE_WEIGHT = 1.0
+EXACT_BONUS = 0.1
+
+GENERATION_CHECK_SECONDS = 10
+FUZZY_MIN_LENGTH = 4
+FUZZY_PREFIX_LENGTH = 1
+
+locality_index_query = """
+SELECT id, cvegeo, name, municipality_name, state_name, has_data, ST_X(location), ST_Y(location)
+FROM map_locality"""
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents, e.g. `Ñuu Savi` -> `nuu savi`.
+    """
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r'\w+', fold(text))
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """True if `a` can be turned into `b` with at most one insertion, deletion,
+    substitution or transposition of adjacent characters.
+    """
+    if abs(len(a) - len(b)) > 1:
+        return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (a[i:i + 2] == b[i:i + 2][::-1] and a[i + 2:] == b[i + 2:])
+    if len(a) > len(b):
+        return a[i + 1:] == b[i:]
+    return a[i:] == b[i + 1:]
+
+
+class LocalityRecord:
+    __slots__ = ('id', 'cvegeo', 'name', 'municipality_name', 'state_name', 'has_data', 'lng', 'lat')
+
+    def __init__(self, id, cvegeo, name, municipality_name, state_name, has_data, lng, lat):
+        self.id = id
+        self.cvegeo = cvegeo
+        self.name = name
+        self.municipality_name = municipality_name
+        self.state_name = state_name
+        self.has_data = has_data
+        self.lng = lng
+        self.lat = lat
+
+    def to_representation(self) -> Dict[str, Any]:
+        """Same keys as `LocalitySerializer` returns for these fields.
+        """
+        return {
+            'id': self.id,
+            'cvegeo': self.cvegeo,
+            'name': self.name,
+            'municipality_name': self.municipality_name,
+            'state_name': self.state_name,
+            'has_data': self.has_data,
+            'location': {'lng': round(self.lng, 5), 'lat': round(self.lat, 5)},
+        }
+
+
+class LocalityIndex:
+    """Accent-folded prefix index over locality, municipality and state names.
+
+    Each token of each name is an entry in `tokens`, a sorted list, with
+    parallel arrays holding record position and field weight of entry. Prefix
+    lookups are two binary searches, and entries matching a prefix are
+    contiguous. Fuzzy lookups scan distinct tokens in `vocabulary`.
+    """
+    def __init__(self, rows, generation: Optional[List[int]] = None):
+        self.generation = generation
+        self.records: List[LocalityRecord] = []
+        entries: List[Tuple[str, int, float]] = []
+        # municipality and state names repeat a lot, tokenize each one once
+        tokenized: Dict[str, Set[str]] = {}
+        for row in rows:
+            position = len(self.records)
+            record = LocalityRecord(*row)
+            self.records.append(record)
+            for text, weight in (
+                (record.name, NAME_WEIGHT),
+                (record.municipality_name, MUNICIPALITY_WEIGHT),
+                (record.state_name, STATE_WEIGHT),
+            ):
+                tokens = tokenized.get(text)
+                if tokens is None:
+                    tokens = tokenized[text] = set(tokenize(text))
+                for token in tokens:
+                    entries.append((token, position, weight))
+        entries.sort()
+        self.tokens = [e[0] for e in entries]
+        self.positions = array('i', (e[1] for e in entries))
+        self.weights = array('f', (e[2] for e in entries))
+        self.vocabulary = [t for i, t in enumerate(self.tokens) if i == 0 or t != self.tokens[i - 1]]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + '\uffff', start)
+        return start, end
+
+    def match(self, token: str, fuzzy: bool) -> Dict[int, float]:
+        """Best score of each record with a token starting with `token`. If
+        there are none and `fuzzy` is passed, tokens starting with a prefix at
+        most one edit away from `token` also match, with half the weight.
+        """
+        scores: Dict[int, float] = {}
+        start, end = self.prefix_range(token)
+        for i in range(start, end):
+            score = self.weights[i] + (EXACT_BONUS if self.tokens[i] == token else 0)
+            position = self.positions[i]
+            if score > scores.get(position, 0):
+                scores[position] = score
+        if scores or not fuzzy or len(token) < FUZZY_MIN_LENGTH:
+            return scores
+
+        start = bisect.bisect_left(self.vocabulary, token[:FUZZY_PREFIX_LENGTH])
+        end = bisect.bisect_left(self.vocabulary, token[:FUZZY_PREFIX_LENGTH] + '\uffff', start)
+        lengths = (len(token) - 1, len(token), len(token) + 1)
+        for candidate in self.vocabulary[start:end]:
+            if not any(within_one_edit(token, candidate[:length]) for length in lengths):
+                continue
+            for i in range(*self.prefix_range(candidate)):
+                if self.tokens[i] != candidate:
+                    break
+                score = self.weights[i] / 2
+                position = self.positions[i]
+                if score > scores.get(position, 0):
+                    scores[position] = score
+        return scores
+
+    def search(self, query: str, limit: int = 10, has_data: Optional[bool] = None,
+               fuzzy: bool = True) -> List[LocalityRecord]:
+        """Records matching all tokens in `query`, ranked like `LocalitySearch`:
+        name and state matches weigh more than municipality matches.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # rarest token first, so later tokens only score surviving records
+        ordered = sorted(set(tokens), key=lambda t: self.prefix_range(t)[1] - self.prefix_range(t)[0])
+        scores = self.match(ordered[0], fuzzy)
+        for token in ordered[1:]:
+            if not scores:
+                return []
+            token_scores = self.match(token, fuzzy)
+            scores = {p: s + token_scores[p] for p, s in scores.items() if p in token_scores}
+
+        records = self.records
+        candidates: Iterator[Tuple[int, float]] = iter(scores.items())
+        if has_data is not None:
+            candidates = ((p, s) for p, s in candidates if records[p].has_data is has_data)
+        ranked = heapq.nsmallest(limit, candidates, key=lambda c: (-c[1], len(records[c[0]].name), records[c[0]].id))
+        return [records[p] for p, _ in ranked]
+
+
+def load_locality_index(generation: Optional[List[int]] = None) -> LocalityIndex:
+    with connection.cursor() as cursor:
+        cursor.execute(locality_index_query)
+        return LocalityIndex(cursor.fetchall(), generation)
+
+
+_index: Optional[LocalityIndex] = None
+_index_checked = 0.0
+_index_rebuilding = False
+_index_lock = threading.Lock()
+
+
+def rebuild_locality_index(generation: List[int]) -> None:
+    """Runs in background thread, then swaps new index in.
+    """
+    global _index, _index_rebuilding
+    try:
+        _index = load_locality_index(generation)
+    finally:
+        _index_rebuilding = False
+        connection.close()  # thread's own connection
+
+
+def get_locality_index() -> LocalityIndex:
+    """Index shared by all threads in process. Rebuilt when `locality` generation
+    changes (see `helpers.cache.bump_generation`), which is checked at most every
+    `GENERATION_CHECK_SECONDS`. Rebuild runs in a background thread, and
+    requests keep using previous index until it's done; only if there's no
+    index yet, e.g. warming it at worker start failed, do requests wait for it.
+    """
+    global _index, _index_checked, _index_rebuilding
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_locality_index(get_generations(['locality']))
+                _index_checked = time.time()
+            return _index
+    if time.time() - _index_checked < GENERATION_CHECK_SECONDS:
+        return index
+
+    with _index_lock:
+        if _index_rebuilding or time.time() - _index_checked < GENERATION_CHECK_SECONDS:
+            return index
+        _index_checked = time.time()
+        generation = get_generations(['locality'])
+        if index.generation != generation:
+            _index_rebuilding = True
+            threading.Thread(target=rebuild_locality_index, args=(generation,), daemon=True).start()
+    return index
+
+
+def warm_locality_index() -> None:
+    """Load index at worker start, so first autocomplete request doesn't wait for it.
+    """
+    get_locality_index()
@@ -6,6 +6,7 @@ from db.map.models import State, Municipality, Locality, Establishment, Voluntee
 from db.map.models import Organization, Action, ActionLog, Submission, Donor, Donation, Share, Testimonial
 from db.users.models import DonorUser, VolunteerUser
 from api.mixins import DynamicFieldsMixin
+from api.cache import FragmentCacheMixin, FragmentCacheListSerializer, FragmentCacheRootMixin
 from api.fields import LatLngField
 from .base import Serializer, ModelSerializer
 
@@ -116,7 +117,7 @@ class MunicipalitySerializer(ModelSerializer):
         fields = '__all__'
 
 
-class LocalitySerializer(DynamicFieldsMixin, ModelSerializer):
+class LocalitySerializer(FragmentCacheMixin, DynamicFieldsMixin, ModelSerializer):
     location = LatLngField()
 
     class Meta:
@@ -130,7 +131,6 @@ class LocalitySerializer(DynamicFieldsMixin, ModelSerializer):
 class LocalityRawSerializer(ModelSerializer):
     meta = serializers.SerializerMethodField()
     location = LatLngField()
-    action_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Locality
@@ -141,24 +141,15 @@ class LocalityRawSerializer(ModelSerializer):
         keys = ['destroyed', 'habit', 'margGrade', 'notHabit', 'total']
         return {key: obj.meta.get(key) for key in keys}
 
-    def get_action_count(self, obj):
-        return obj.action_count
-
 
 class LocalityDetailSerializer(ModelSerializer):
-    _PREFETCH_RELATED_FIELDS = ['action_set']
-
     meta = serializers.JSONField()
     location = LatLngField()
-    action_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Locality
         fields = '__all__'
 
-    def get_action_count(self, obj):
-        return obj.action_set.filter(published=True).count()
-
 
 class ActionSerializer(ModelSerializer):
     class Meta:
@@ -232,7 +223,7 @@ class ActionLocalitySerializer(ModelSerializer):
         fields = ('id', 'locality', 'action_type', 'budget', 'organization_id', 'score', 'level')
 
 
-class OrganizationMiniSerializer(DynamicFieldsMixin, ModelSerializer):
+class OrganizationMiniSerializer(FragmentCacheMixin, DynamicFieldsMixin, ModelSerializer):
     class Meta:
         model = Organization
         exclude = ('secret_key',)
@@ -247,6 +238,7 @@ class ActionMiniSerializer(ModelSerializer):
     class Meta:
         model = Action
         fields = ('id', 'key', 'organization', 'locality', 'action_type', 'score', 'level')
+        list_serializer_class = FragmentCacheListSerializer
 
 
 class ActionLocalityOrganizationSerializer(ActionLocalitySerializer):
@@ -332,9 +324,10 @@ class ActionSubmissionsSerializer(DynamicFieldsMixin, ModelSerializer):
     class Meta:
         model = Action
         fields = '__all__'
+        list_serializer_class = FragmentCacheListSerializer
 
 
-class OrganizationDetailSerializer(ModelSerializer):
+class OrganizationDetailSerializer(FragmentCacheRootMixin, ModelSerializer):
     _PREFETCH_FUNCTIONS = [
         lambda: Prefetch('action_set', queryset=Action.objects.select_related(
             'locality', 'organization'
@@ -396,6 +389,7 @@ class DonationActionSubmissionsSerializer(ModelSerializer):
     class Meta:
         model = Donation
         fields = '__all__'
+        list_serializer_class = FragmentCacheListSerializer
 
 
 class DonorSerializer(ModelSerializer):
@@ -435,3 +429,4 @@ class VolunteerOpportunityDetailSerializer(ModelSerializer):
     class Meta:
         model = VolunteerOpportunity
         fields = '__all__'
+        list_serializer_class = FragmentCacheListSerializer
@@ -0,0 +1,78 @@
+from typing import Any, Callable, Iterator
+import itertools
+import json
+import sys
+
+from django.db.models.query import QuerySet
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from api.filters import parse_boolean
+
+
+STREAM_BUFFER_ROWS = 500
+
+
+def iterate_page(queryset, offset: int, limit: int) -> Iterator:
+    """Iterate over page without loading it into memory. `QuerySet.iterator`
+    uses a server-side cursor with PostgreSQL, which fetches rows in chunks.
+    """
+    if isinstance(queryset, QuerySet):
+        return queryset[offset:offset + limit].iterator()
+    return itertools.islice(queryset.iterator(), offset, offset + limit)
+
+
+class StreamingListMixin:
+    """A list view mixin that, if `?stream=true` is passed, serializes and sends
+    page of results one chunk at a time in a `StreamingHttpResponse`, instead of
+    building whole page and JSON string in memory. Peak memory doesn't depend on
+    page size, and first bytes reach client sooner.
+
+    Response has same keys as paginated response, but `next` and `previous`
+    come after `results`, because paginator only knows if there's a next page
+    after iterating over page. Streamed responses aren't cached by
+    `cache_page`, which is why streaming is opt-in.
+    """
+    stream_query_param = 'stream'
+
+    # provided by `GenericAPIView`
+    paginator: Any
+    get_serializer: Callable[..., Any]
+
+    def list(self, request, *args, **kwargs):
+        streamed = request.accepted_renderer.format == 'json'  # e.g. not `?format=columnar`
+        if not streamed or not parse_boolean(request.query_params.get(self.stream_query_param)):
+            return super().list(request, *args, **kwargs)
+
+        paginator = self.paginator
+        paginator.request = request
+        paginator.count = sys.maxsize
+        paginator.limit = paginator.get_limit(request)
+        paginator.offset = paginator.get_offset(request)
+        paginator.has_next = False
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(self.stream_page(queryset), content_type='application/json')
+
+    def stream_page(self, queryset) -> Iterator[bytes]:
+        paginator = self.paginator
+        serializer = self.get_serializer()
+        encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+        yield b'{"results":['
+        buffer = []
+        count = 0
+        # fetch one extra row to know if there's a next page
+        for instance in iterate_page(queryset, paginator.offset, paginator.limit + 1):
+            if count == paginator.limit:
+                paginator.has_next = True
+                break
+            buffer.append(encoder.encode(serializer.to_representation(instance)))
+            count += 1
+            if len(buffer) == STREAM_BUFFER_ROWS:
+                yield (',' if count > len(buffer) else '').encode() + ','.join(buffer).encode()
+                buffer = []
+        if buffer:
+            yield (',' if count > len(buffer) else '').encode() + ','.join(buffer).encode()
+
+        links = {'next': paginator.get_next_link(), 'previous': paginator.get_previous_link()}
+        yield '],{}'.format(json.dumps(links)[1:]).encode()
@@ -7,3 +7,11 @@ class BurstRateThrottle(UserRateThrottle):
 
 class SearchBurstRateScopedThrottle(ScopedRateThrottle):
     scope_attr = 'search_burst_throttle_scope'
+
+
+class AutocompleteBurstRateThrottle(UserRateThrottle):
+    scope = 'autocomplete_burst'
+
+
+class MapTileBurstRateThrottle(UserRateThrottle):
+    scope = 'map_tile_burst'
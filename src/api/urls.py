@@ -7,6 +7,7 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
 from api import views
+from api.cache import cache_page_versioned
 
 
 docs_cache = 60 * 60
@@ -26,7 +27,21 @@ schema_view = get_schema_view(
     permission_classes=(permissions.AllowAny,),
 )
 
-# `cache_page` also sets `Cache-Control: max-age=<seconds>` in response headers
+day = 60 * 60 * 24
+
+# models whose changes invalidate responses cached with `cache_page_versioned`
+action_resources = (
+    'action', 'locality', 'organization', 'submission', 'donation', 'donor', 'volunteeropportunity', 'testimonial',
+)
+donor_resources = (
+    'donor', 'donoruser', 'donation', 'action', 'organization', 'locality', 'submission', 'volunteeropportunity',
+)
+organization_resources = (
+    'organization', 'action', 'locality', 'submission', 'donation', 'donor', 'testimonial', 'volunteeropportunity',
+)
+
+# `cache_page` also sets `Cache-Control: max-age=<seconds>` in response headers; `cache_page_versioned` caches
+# responses until a resource they depend on changes, but sets a short `max-age` for clients
 urlpatterns = [
     # autodoc
     url(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=docs_cache), name='schema-json'),
@@ -38,15 +53,18 @@ urlpatterns = [
     url(r'^internal/organization_users/$', views.InternalOrganizationUserList.as_view()),
     url(r'^internal/debug/throw_exception/$', views.InternalDebugThrowException.as_view()),
     url(r'^internal/email_notifications/$', views.InternalEmailNotificationListCreate.as_view()),
+    url(r'^internal/metrics/$', views.InternalMetrics.as_view()),
 
     # public endpoints
     url(r'^$', views.api_root),
 
-    url(r'^actions_cached/$', cache_page(60 * 60)(views.ActionList.as_view())),
-    url(r'^volunteer_opportunities_cached/$', cache_page(60 * 60)(views.VolunteerOpportunityList.as_view())),
-    url(r'^localities_with_actions/$', cache_page(60 * 60)(views.LocalityWithActionList.as_view())),
-    url(r'^landing_metrics/$', cache_page(60 * 60)(views.LandingMetrics.as_view())),
-    url(r'^landing/$', cache_page(60 * 60)(views.Landing.as_view())),
+    url(r'^actions_cached/$', cache_page_versioned(day, action_resources)(views.ActionList.as_view())),
+    url(r'^volunteer_opportunities_cached/$', cache_page_versioned(day, action_resources)(
+        views.VolunteerOpportunityList.as_view())),
+    url(r'^localities_with_actions/$', cache_page_versioned(day, ('locality', 'action'))(
+        views.LocalityWithActionList.as_view())),
+    url(r'^landing_metrics/$', cache_page_versioned(day, action_resources)(views.LandingMetrics.as_view())),
+    url(r'^landing/$', cache_page_versioned(day, action_resources)(views.Landing.as_view())),
 
     url(r'^webhooks/kobo_submission/$', views.KoboSubmissionWebhook.as_view()),
     url(r'^webhooks/discourse_event/$', views.DiscourseEventWebhook.as_view()),
@@ -54,19 +72,23 @@ urlpatterns = [
     url(r'^states/$', cache_page(60 * 5)(views.StateList.as_view())),
     url(r'^municipalities/$', cache_page(60 * 5)(views.MunicipalityList.as_view())),
 
-    url(r'^localities/$', cache_page(60 * 20)(views.LocalityList.as_view()), name='locality-list'),
+    url(r'^localities/$', cache_page_versioned(day, ('locality', 'action'))(views.LocalityList.as_view()),
+        name='locality-list'),
     url(r'^localities_search/$', views.LocalitySearch.as_view()),
+    url(r'^localities_autocomplete/$', views.LocalityAutocomplete.as_view()),
+    url(r'^localities_clusters/$', views.LocalityClusterList.as_view()),
+    url(r'^tiles/(?P<layer>[a-z_]+)/(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+)\.mvt$', views.VectorTile.as_view()),
     url(r'^localities/(?P<pk>[0-9]+)/$', views.LocalityDetail.as_view()),
 
     url(r'^actions/$', views.ActionList.as_view(), name='action-list'),
-    url(r'^actions_mini/$', cache_page(60 * 3)(views.ActionMiniList.as_view())),
-    url(r'^actions/(?P<pk>[0-9]+)/$', cache_page(60 * 0.5)(views.ActionDetail.as_view())),
+    url(r'^actions_mini/$', cache_page_versioned(day, action_resources)(views.ActionMiniList.as_view())),
+    url(r'^actions/(?P<pk>[0-9]+)/$', cache_page_versioned(day, action_resources)(views.ActionDetail.as_view())),
     url(r'^actions/(?P<pk>[0-9]+)/log/$', views.ActionLogList.as_view()),
 
     url(r'^brigada_users/$', views.VolunteerUserCreate.as_view()),
 
     url(r'^volunteer_opportunities/$',
-        cache_page(60 * 3)(views.VolunteerOpportunityList.as_view())),
+        cache_page_versioned(day, action_resources)(views.VolunteerOpportunityList.as_view())),
     url(r'^volunteer_opportunities/(?P<pk>[0-9]+)/$', views.VolunteerOpportunityDetail.as_view()),
     url(r'^volunteer_applications/$', views.VolunteerUserApplicationCreate.as_view()),
 
@@ -80,14 +102,17 @@ urlpatterns = [
     url(r'^submissions/$', views.SubmissionList.as_view(), name='submission-list'),
     url(r'^testimonials/(?P<pk>[0-9]+)/$', views.TestimonialDetail.as_view()),
 
-    url(r'^donations/$', cache_page(60 * 0.5)(views.DonationList.as_view()), name='donation-list'),
+    url(r'^donations/$', cache_page_versioned(day, donor_resources)(views.DonationList.as_view()),
+        name='donation-list'),
 
     url(r'^donors_mini/$', views.DonorMiniList.as_view()),
-    url(r'^donors/$', cache_page(60 * 3)(views.DonorList.as_view()), name='donor-list'),
-    url(r'^donors/(?P<pk>[0-9]+)/$', cache_page(60 * 0.5)(views.DonorDetail.as_view())),
+    url(r'^donors/$', cache_page_versioned(day, donor_resources)(views.DonorList.as_view()), name='donor-list'),
+    url(r'^donors/(?P<pk>[0-9]+)/$', cache_page_versioned(day, donor_resources)(views.DonorDetail.as_view())),
 
-    url(r'^organizations/$', cache_page(60 * 3)(views.OrganizationList.as_view()), name='organization-list'),
-    url(r'^organizations/(?P<pk>[0-9]+)/$', cache_page(60 * 0.5)(views.OrganizationDetail.as_view())),
+    url(r'^organizations/$', cache_page_versioned(day, organization_resources)(views.OrganizationList.as_view()),
+        name='organization-list'),
+    url(r'^organizations/(?P<pk>[0-9]+)/$', cache_page_versioned(day, organization_resources)(
+        views.OrganizationDetail.as_view())),
 
     url(r'^establishments/$', cache_page(60 * 30)(views.EstablishmentList.as_view())),
 
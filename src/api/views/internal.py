@@ -1,9 +1,12 @@
 from rest_framework.views import APIView
+from rest_framework.response import Response
 from rest_framework import permissions, generics
 
 from db.users.models import OrganizationUser, DonorUser
 from db.map.models import AppVersion, EmailNotification
+from db.config import validation_queries_run, validation_queries_skipped
 from api.backends import InternalAuthentication
+from api.middleware import get_metrics, reset_metrics
 from api.serializers import OrganizationUserSerializer, DonorUserSerializer, AppVersionSerializer
 from api.serializers import EmailNotificationSerializer
 
@@ -56,3 +59,23 @@ class InternalAppVersionListCreate(generics.ListCreateAPIView):
 
     def get_queryset(self):
         return AppVersion.objects.all()
+
+
+class InternalMetrics(APIView):
+    """Request metrics by view, recorded by `ProfilingMiddleware`, and validation
+    queries run and skipped by `BaseModel.save` in this process.
+
+    curl -H "Authorization: Bearer `cat .internal-auth-key`" https://api.brigada.mx/api/internal/metrics/
+    """
+    authentication_classes = (InternalAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'views': get_metrics(),
+            'validation_queries': {'run': validation_queries_run, 'skipped': validation_queries_skipped},
+        })
+
+    def delete(self, request, *args, **kwargs):
+        reset_metrics()
+        return Response(status=204)
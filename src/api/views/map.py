@@ -1,15 +1,19 @@
-import os
+from typing import Any, Dict, List, Tuple
+import copy
 
-from django.db import transaction
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.db.models import Q, Sum
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ValidationError
+from django.http import HttpResponse, QueryDict
+from django.utils.cache import patch_response_headers
 
 from rest_framework import generics
+from rest_framework.exceptions import APIException
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from raven.contrib.django.raven_compat.models import client
-import requests
 
 from db.map.models import State, Municipality, Locality, Action, Organization, Establishment, Submission, Testimonial
 from db.map.models import Donor, Donation, VolunteerOpportunity, VolunteerApplication, Share
@@ -25,16 +29,22 @@ from api.serializers import DonorSerializer, DonorHasUserSerializer, DonationAct
 from api.serializers import VolunteerOpportunityDetailSerializer, VolunteerUserApplicationCreateSerializer
 from api.serializers import ShareSerializer, ShareCreateSerializer, ShareSetUserSerializer, SupportTicketSerializer
 from api.paginators import LargeNoCountPagination
-from api.throttles import SearchBurstRateScopedThrottle
+from api.renderers import COLUMNAR_RENDERER_CLASSES, FormatOnlyContentNegotiation
+from api.search import get_locality_index
+from api.streaming import StreamingListMixin
+from api.throttles import SearchBurstRateScopedThrottle, AutocompleteBurstRateThrottle, MapTileBurstRateThrottle
 from api.filters import parse_boolean, ActionFilter, EstablishmentFilter, SubmissionFilter, DonationFilter
 from api.filters import VolunteerOpportunityFilter
 from jobs.notifications import send_volunteer_application_email
 from jobs.messages import send_email
-from helpers.http import raise_for_status
+from jobs.maintenance import counted_image_condition, synced_image_prefix
+from helpers.cache import get_generations
+from helpers.tiles import bbox_tiles, parse_bbox, parse_zoom, tile_bounds, tile_bounds_mercator, valid_tile
 
 
 class StateList(generics.ListAPIView):
     serializer_class = StateSerializer
+    query_budget = 1
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -44,6 +54,7 @@ class StateList(generics.ListAPIView):
 
 class MunicipalityList(generics.ListAPIView):
     serializer_class = MunicipalitySerializer
+    query_budget = 1
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -51,39 +62,24 @@ class MunicipalityList(generics.ListAPIView):
         )
 
 
-locality_list_raw_query = """
-SELECT
-    map_locality.*,
-    (SELECT
-        COUNT(*)
-        FROM map_action
-        WHERE map_action.locality_id = map_locality.id AND map_action.published = true
-    ) AS action_count
-FROM map_locality
-WHERE map_locality.has_data = true
-UNION
-SELECT
-    map_locality.*,
-    (SELECT
-        COUNT(*)
-        FROM map_action
-        WHERE map_action.locality_id = map_locality.id AND map_action.published = true
-    ) AS action_count
-FROM map_locality
-WHERE map_locality.id in (select distinct locality_id from map_action where published = true)"""
-
-
-class LocalityList(generics.ListAPIView):
+class LocalityList(StreamingListMixin, generics.ListAPIView):
+    renderer_classes = COLUMNAR_RENDERER_CLASSES
+    content_negotiation_class = FormatOnlyContentNegotiation
     serializer_class = LocalityRawSerializer
     pagination_class = LargeNoCountPagination
+    query_budget = 1
 
     def get_queryset(self):
-        return Locality.objects.raw(locality_list_raw_query)
+        # uses partial index on `map_locality (id)`, see migration `0100_locality_action_count`
+        return Locality.objects.filter(Q(has_data=True) | Q(action_count__gt=0)).order_by('id')
 
 
-class LocalityWithActionList(generics.ListAPIView):
+class LocalityWithActionList(StreamingListMixin, generics.ListAPIView):
+    renderer_classes = COLUMNAR_RENDERER_CLASSES
+    content_negotiation_class = FormatOnlyContentNegotiation
     serializer_class = LocalitySerializer
     pagination_class = LargeNoCountPagination
+    query_budget = 1
 
     def get_queryset(self):
         return Locality.objects.filter(action__isnull=False).distinct()
@@ -91,6 +87,7 @@ class LocalityWithActionList(generics.ListAPIView):
 
 class LocalityDetail(generics.RetrieveAPIView):
     serializer_class = LocalityDetailSerializer
+    query_budget = 1
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -99,8 +96,12 @@ class LocalityDetail(generics.RetrieveAPIView):
 
 
 class EstablishmentList(generics.ListAPIView):
+    renderer_classes = COLUMNAR_RENDERER_CLASSES
+    content_negotiation_class = FormatOnlyContentNegotiation
     serializer_class = EstablishmentSerializer
     filter_class = EstablishmentFilter
+    keyset_ordering = ('-created', '-id')
+    query_budget = 1
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -112,6 +113,8 @@ class ActionList(generics.ListAPIView):
     serializer_class = ActionSubmissionsSerializer
     filter_class = ActionFilter
     ordering_fields = ('created', 'start_date', 'end_date')
+    keyset_ordering = ('-created', '-id')
+    query_budget = 4
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -120,7 +123,10 @@ class ActionList(generics.ListAPIView):
 
 
 class ActionMiniList(generics.ListAPIView):
+    renderer_classes = COLUMNAR_RENDERER_CLASSES
+    content_negotiation_class = FormatOnlyContentNegotiation
     serializer_class = ActionMiniSerializer
+    query_budget = 1
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -130,6 +136,7 @@ class ActionMiniList(generics.ListAPIView):
 
 class ActionDetail(generics.RetrieveAPIView):
     serializer_class = ActionDetailSerializer
+    query_budget = 5
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -139,6 +146,7 @@ class ActionDetail(generics.RetrieveAPIView):
 
 class ActionLogList(generics.ListAPIView):
     serializer_class = ActionLogSerializer
+    query_budget = 2
 
     def get_queryset(self):
         action = get_object_or_404(Action, pk=self.kwargs['pk'], published=True)
@@ -149,6 +157,7 @@ class ActionLogList(generics.ListAPIView):
 
 class OrganizationList(generics.ListAPIView):
     serializer_class = OrganizationSerializer
+    query_budget = 2
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -158,6 +167,7 @@ class OrganizationList(generics.ListAPIView):
 
 class OrganizationDetail(generics.RetrieveAPIView):
     serializer_class = OrganizationDetailSerializer
+    query_budget = 5
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -168,6 +178,8 @@ class OrganizationDetail(generics.RetrieveAPIView):
 class SubmissionList(generics.ListAPIView):
     serializer_class = SubmissionSerializer
     filter_class = SubmissionFilter
+    keyset_ordering = ('-submitted', '-id')
+    query_budget = 1
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -179,16 +191,20 @@ class SubmissionList(generics.ListAPIView):
 
 class TestimonialDetail(generics.RetrieveAPIView):
     serializer_class = TestimonialPublicSerializer
+    query_budget = 1
 
     def get_queryset(self):
         return Testimonial.objects.filter(published=True, video__synced=True)
 
 
+# `has_data` condition is interpolated rather than passed as a param, so planner can use partial index
+# `idx_fts_locality_search_has_data`, see migration `0102_locality_search_index`
 locality_list_search_query = """
+WITH search AS (SELECT to_tsquery('spanish', unaccent(%s)) AS query)
 SELECT id, cvegeo, location, name, municipality_name, state_name, has_data
-FROM locality_search_index
-WHERE document @@ to_tsquery('spanish', %s)
-ORDER BY ts_rank(document, to_tsquery('spanish', %s)) DESC
+FROM locality_search_index, search
+WHERE document @@ search.query {}
+ORDER BY ts_rank(document, search.query) DESC
 LIMIT 50"""
 
 
@@ -196,21 +212,260 @@ class LocalitySearch(generics.ListAPIView):
     search_burst_throttle_scope = 'search_burst'
     throttle_classes = (SearchBurstRateScopedThrottle,)
     serializer_class = LocalitySerializer
+    query_budget = 1
 
     def get_queryset(self):
         search = self.request.query_params.get('search', '')
         tokens = ' & '.join(search.split())
         tokens = ''.join(ch for ch in tokens if ch.isalnum() or ch in (' ', '&'))
-        queryset = Locality.objects.raw(locality_list_search_query, [tokens, tokens])
 
         has_data = parse_boolean(self.request.query_params.get('has_data'))
-        if has_data is None:
-            return queryset
-        return [l for l in queryset if l.has_data is has_data]
+        condition = ''
+        if has_data is not None:
+            condition = 'AND has_data = true' if has_data else 'AND has_data = false'
+        return Locality.objects.raw(locality_list_search_query.format(condition), [tokens])
+
+
+class LocalityAutocomplete(APIView):
+    """Type-ahead search served from in-process `LocalityIndex`, so it doesn't
+    query DB. It's requested on every keystroke, so it has its own throttle,
+    looser than `search_burst` throttle of `LocalitySearch`.
+    """
+    throttle_classes = (AutocompleteBurstRateThrottle,)
+    query_budget = 1  # index is rebuilt from DB after localities change
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        records = get_locality_index().search(
+            request.query_params.get('search', ''),
+            limit=limit,
+            has_data=parse_boolean(request.query_params.get('has_data')),
+            fuzzy=parse_boolean(request.query_params.get('fuzzy')) is not False,
+        )
+        return Response({'results': [r.to_representation() for r in records]}, status=200)
+
+
+CLUSTER_CELLS_PER_TILE = 8
+CLUSTER_MAX_TILES = 64
+CLUSTER_TIMEOUT = 60 * 60 * 24
+CLUSTER_META_KEYS = ('destroyed', 'habit', 'notHabit', 'total')
+
+# clusters listed localities (same ones as `LocalityList`) in each tile, on a grid of `%(cells)s` x `%(cells)s`
+# cells aligned with tile edges; tile ranges are half-open so localities on edges are counted once
+locality_clusters_query = """
+WITH tiles AS (
+    SELECT x, y, west, south, east, north,
+        (east - west) / %(cells)s AS cell_width, (north - south) / %(cells)s AS cell_height
+    FROM unnest(%(xs)s::integer[], %(ys)s::integer[], %(wests)s::float8[], %(souths)s::float8[], %(easts)s::float8[],
+        %(norths)s::float8[]) AS t (x, y, west, south, east, north)
+)
+SELECT
+    t.x, t.y, COUNT(*), MIN(l.id), AVG(ST_X(l.location)), AVG(ST_Y(l.location)), SUM(l.action_count), {}
+FROM tiles t
+JOIN map_locality l ON
+    l.location && ST_MakeEnvelope(t.west, t.south, t.east, t.north, 4326) AND
+    ST_X(l.location) >= t.west AND ST_X(l.location) < t.east AND
+    ST_Y(l.location) >= t.south AND ST_Y(l.location) < t.north
+WHERE l.has_data = true OR l.action_count > 0
+GROUP BY t.x, t.y, ST_SnapToGrid(
+    l.location, t.west + t.cell_width / 2, t.south + t.cell_height / 2, t.cell_width, t.cell_height
+)""".format(', '.join(
+    f"SUM(CASE WHEN jsonb_typeof(l.meta -> '{k}') = 'number' THEN (l.meta ->> '{k}')::float8 ELSE 0 END)"
+    for k in CLUSTER_META_KEYS
+))
+
+
+def cluster_key(z: int, x: int, y: int, generations: List[int]) -> str:
+    return 'clusters:{}:{}:{}:{}'.format('.'.join(str(g) for g in generations), z, x, y)
+
+
+def get_tile_clusters(z: int, tiles: List[Tuple[int, int]]) -> Dict[Tuple[int, int], List[Dict[str, Any]]]:
+    """Clusters of localities in each tile. Tiles are cached until localities or
+    actions change, and all tiles missing from cache are computed in one query.
+    """
+    generations = get_generations(['locality', 'action'])
+    keys = {cluster_key(z, x, y, generations): (x, y) for x, y in tiles}
+    clusters = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+    missing = [tile for tile in tiles if tile not in clusters]
+    if not missing:
+        return clusters
+
+    bounds = [tile_bounds(z, x, y) for x, y in missing]
+    params = {
+        'cells': CLUSTER_CELLS_PER_TILE,
+        'xs': [x for x, _ in missing], 'ys': [y for _, y in missing],
+        'wests': [b[0] for b in bounds], 'souths': [b[1] for b in bounds],
+        'easts': [b[2] for b in bounds], 'norths': [b[3] for b in bounds],
+    }
+    computed: Dict[Tuple[int, int], List[Dict[str, Any]]] = {tile: [] for tile in missing}
+    with connection.cursor() as cursor:
+        cursor.execute(locality_clusters_query, params)
+        for x, y, count, locality_id, lng, lat, action_count, *damage in cursor.fetchall():
+            computed[(x, y)].append({
+                'count': count,
+                'locality_id': locality_id if count == 1 else None,
+                'location': {'lng': round(lng, 5), 'lat': round(lat, 5)},
+                'action_count': action_count,
+                **{k: round(v) for k, v in zip(CLUSTER_META_KEYS, damage)},
+            })
+    cache.set_many({cluster_key(z, x, y, generations): value for (x, y), value in computed.items()}, CLUSTER_TIMEOUT)
+    return {**clusters, **computed}
+
+
+class LocalityClusterList(APIView):
+    """Clusters of localities listed by `LocalityList` within `bbox`
+    (`west,south,east,north`), for map at `zoom`. Each cluster has number of
+    localities, centroid, and sums of `action_count` and of damage metrics in
+    `meta`. Clusters are computed for each XYZ tile intersecting `bbox`, on a
+    grid of `CLUSTER_CELLS_PER_TILE` x `CLUSTER_CELLS_PER_TILE` cells.
+    """
+    throttle_classes = (MapTileBurstRateThrottle,)
+    query_budget = 1
+
+    def get(self, request, *args, **kwargs):
+        try:
+            bbox = parse_bbox(request.query_params.get('bbox', ''))
+            zoom = parse_zoom(request.query_params.get('zoom', ''))
+        except ValueError as e:
+            return Response({'error': f'bbox and zoom are required and must be valid: {e}'}, status=400)
+        tiles = bbox_tiles(bbox, zoom)
+        if len(tiles) > CLUSTER_MAX_TILES:
+            return Response({'error': f'bbox covers more than {CLUSTER_MAX_TILES} tiles, zoom in'}, status=400)
+
+        west, south, east, north = bbox
+        clusters = [
+            cluster
+            for clusters_by_tile in get_tile_clusters(zoom, tiles).values()
+            for cluster in clusters_by_tile
+            if west <= cluster['location']['lng'] <= east and south <= cluster['location']['lat'] <= north
+        ]
+        return Response({'zoom': zoom, 'results': clusters}, status=200)
+
+
+TILE_TIMEOUT = 60 * 60 * 24
+TILE_MAX_AGE = 60 * 5
+TILE_EXTENT = 4096
+
+# same count as `Submission.counted_image_count` and `reconcile_action_image_count`
+submission_image_count = f'''(
+    SELECT COUNT(*) FROM jsonb_array_elements(t.images) AS image WHERE {counted_image_condition}
+)'''
+
+# attributes each layer can include in its features, and which ones it includes by default; `resources` are models
+# whose changes invalidate cached tiles, see `helpers.cache.bump_generation`
+TILE_LAYERS: Dict[str, Dict[str, Any]] = {
+    'localities': {
+        'table': 'map_locality',
+        'where': 't.has_data = true OR t.action_count > 0',
+        'fields': {
+            'id': 't.id', 'cvegeo': 't.cvegeo', 'name': 't.name', 'municipality_name': 't.municipality_name',
+            'state_name': 't.state_name', 'has_data': 't.has_data', 'action_count': 't.action_count',
+        },
+        'default_fields': ('id', 'name', 'has_data', 'action_count'),
+        'resources': ('locality', 'action'),
+        'min_zoom': 0,
+    },
+    'submissions': {
+        'table': 'map_submission',
+        'where': 't.published = true AND t.archived = false',
+        'fields': {
+            'id': 't.id', 'action_id': 't.action_id', 'organization_id': 't.organization_id',
+            'image_count': submission_image_count,
+            'submitted': 'extract(epoch FROM t.submitted)::bigint',
+        },
+        'default_fields': ('id', 'action_id', 'organization_id'),
+        'resources': ('submission',),
+        'min_zoom': 0,
+    },
+    'establishments': {
+        'table': 'map_establishment',
+        'where': 'true',
+        'fields': {
+            'id': 't.id', 'name': 't.nom_estab', 'scian_group_id': 't.scian_group_id', 'locality_id': 't.locality_id',
+            'per_ocu': 't.per_ocu',
+        },
+        'default_fields': ('id', 'name', 'scian_group_id'),
+        'resources': ('establishment',),
+        'min_zoom': 10,  # 2M+ establishments, tiles at lower zooms would be huge
+    },
+}
+
+tile_query = """
+SELECT ST_AsMVT(tile, %(layer)s, %(extent)s, 'geom')
+FROM (
+    SELECT {columns}, ST_AsMVTGeom(ST_Transform(t.location, 3857), bounds.mercator, %(extent)s, 64, true) AS geom
+    FROM {table} t, (
+        SELECT ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 3857) AS mercator
+    ) AS bounds
+    WHERE t.location && ST_Transform(bounds.mercator, 4326) AND ({where})
+) AS tile"""
+
+
+def get_tile(layer: str, fields: List[str], z: int, x: int, y: int) -> bytes:
+    """Vector tile of `layer`, cached until one of layer's resources changes.
+    """
+    config = TILE_LAYERS[layer]
+    generations = get_generations(config['resources'])
+    key = 'tile:{}:{}:{}:{}:{}:{}'.format(
+        layer, '.'.join(str(g) for g in generations), ','.join(fields), z, x, y,
+    )
+    tile = cache.get(key)
+    if tile is not None:
+        return tile
+
+    query = tile_query.format(
+        columns=', '.join(f'{config["fields"][f]} AS {f}' for f in fields),
+        table=config['table'],
+        where=config['where'],
+    )
+    west, south, east, north = tile_bounds_mercator(z, x, y)
+    params = {
+        'layer': layer, 'extent': TILE_EXTENT, 'west': west, 'south': south, 'east': east, 'north': north,
+        'prefix': synced_image_prefix(),
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+    tile = bytes(row[0]) if row and row[0] is not None else b''
+    cache.set(key, tile, TILE_TIMEOUT)
+    return tile
+
+
+class VectorTile(APIView):
+    """Mapbox vector tile of localities, submissions or establishments, built by
+    PostGIS `ST_AsMVT`. `fields` query param selects feature attributes, from
+    ones listed in `TILE_LAYERS`.
+    """
+    throttle_classes = (MapTileBurstRateThrottle,)
+    query_budget = 1
+
+    def get(self, request, *args, **kwargs):
+        layer = kwargs['layer']
+        z, x, y = int(kwargs['z']), int(kwargs['x']), int(kwargs['y'])
+        config = TILE_LAYERS.get(layer)
+        if config is None:
+            return Response({'error': f'layer must be one of {", ".join(sorted(TILE_LAYERS))}'}, status=404)
+        if not valid_tile(z, x, y):
+            return Response({'error': 'tile does not exist'}, status=404)
+
+        fields = request.query_params.get('fields')
+        fields = sorted(set(fields.split(','))) if fields else list(config['default_fields'])
+        invalid = [f for f in fields if f not in config['fields']]
+        if invalid:
+            return Response({'error': f'invalid fields for {layer}: {", ".join(invalid)}'}, status=400)
+
+        tile = b'' if z < config['min_zoom'] else get_tile(layer, fields, z, x, y)
+        response = HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+        patch_response_headers(response, TILE_MAX_AGE)
+        return response
 
 
 class DonorMiniList(generics.ListAPIView):
     serializer_class = DonorHasUserSerializer
+    query_budget = 2
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -220,6 +475,7 @@ class DonorMiniList(generics.ListAPIView):
 
 class DonorList(generics.ListAPIView):
     serializer_class = DonorSerializer
+    query_budget = 3
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -229,6 +485,7 @@ class DonorList(generics.ListAPIView):
 
 class DonorDetail(generics.RetrieveAPIView):
     serializer_class = DonorSerializer
+    query_budget = 3
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -239,6 +496,7 @@ class DonorDetail(generics.RetrieveAPIView):
 class DonationList(generics.ListAPIView):
     serializer_class = DonationActionSubmissionsSerializer
     filter_class = DonationFilter
+    query_budget = 4
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -248,6 +506,7 @@ class DonationList(generics.ListAPIView):
 
 class VolunteerOpportunityDetail(generics.RetrieveAPIView):
     serializer_class = VolunteerOpportunityDetailSerializer
+    query_budget = 1
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -259,6 +518,7 @@ class VolunteerOpportunityList(generics.ListAPIView):
     serializer_class = VolunteerOpportunityDetailSerializer
     filter_class = VolunteerOpportunityFilter
     ordering_fields = ('action__score', 'created', 'start_date', 'end_date')
+    query_budget = 1
 
     def get_queryset(self):
         return self.get_serializer_class().setup_eager_loading(
@@ -399,6 +659,8 @@ class SupportTicketCreate(APIView):
 
 
 class LandingMetrics(APIView):
+    query_budget = 4
+
     def get(self, request, *args, **kwargs):
         groups = (
             Organization.objects.exclude(desc='').count() +
@@ -411,22 +673,38 @@ class LandingMetrics(APIView):
         }, status=200)
 
 
+def get_view_data(view_class, request, path: str, query: str = ''):
+    """Run a `GET` view in-process, with same headers as `request` but `path`
+    and `query` string, and return its response data. Avoids an HTTP request
+    back to API, which holds a worker while waiting for another one.
+
+    Calling view already authenticated and throttled request, so view runs
+    without authentication, permissions or throttles; it must be public.
+    """
+    sub_request = copy.copy(request._request)
+    sub_request.path = sub_request.path_info = path
+    sub_request.GET = QueryDict(query)
+    sub_request.META = {**request._request.META, 'QUERY_STRING': query, 'PATH_INFO': path}
+    view = view_class.as_view(authentication_classes=(), permission_classes=(), throttle_classes=())
+    response = view(sub_request)
+    if response.status_code != 200:
+        raise APIException(f'{path}?{query} returned {response.status_code}')
+    return response.data
+
+
 class Landing(APIView):
+    query_budget = 10
+
     def get(self, request, *args, **kwargs):
         action_fields = 'id,locality,organization,donations,action_type,budget,target,unit_of_measurement,preview'
-        action_query = f'?level__gte=2&has_start_date=true&ordering=-start_date&page_size=100&fields={action_fields}'
-        opportunities_query = '?transparency_level__gte=2&ordering=-created&page_size=100'
-
-        paths = [
-            ('metrics', '/landing_metrics/'),
-            ('localities', '/localities_with_actions/?page_size=10000'),
-            ('opportunities', f'/volunteer_opportunities_cached/{opportunities_query}'),
-            ('actions', f'/actions_cached/{action_query}'),
+        action_query = f'level__gte=2&has_start_date=true&ordering=-start_date&page_size=100&fields={action_fields}'
+        opportunities_query = 'transparency_level__gte=2&ordering=-created&page_size=100'
+
+        views = [
+            ('metrics', LandingMetrics, '/api/landing_metrics/', ''),
+            ('localities', LocalityWithActionList, '/api/localities_with_actions/', 'page_size=10000'),
+            ('opportunities', VolunteerOpportunityList, '/api/volunteer_opportunities_cached/', opportunities_query),
+            ('actions', ActionList, '/api/actions_cached/', action_query),
         ]
-        data = {}
-
-        for key, path in paths:
-            r = requests.get(f'{os.getenv("CUSTOM_API_URL")}{path}')
-            raise_for_status(r)
-            data[key] = r.json()
+        data = {key: get_view_data(view_class, request, path, query) for key, view_class, path, query in views}
         return Response(data, status=200)
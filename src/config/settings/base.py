@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -83,6 +84,22 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 CORS_ALLOW_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
 
+# record query count, timings and response size of each request, see `api.middleware.ProfilingMiddleware`
+PROFILING = os.getenv('CUSTOM_PROFILING') == 'true'
+# raise if a view runs more queries than its `query_budget`
+QUERY_BUDGET_ENFORCE = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # settings for dependencies (keep at the end of file)
 from config.settings.dependencies.celery import *
 from config.settings.dependencies.rest_framework import *
@@ -20,11 +20,28 @@ CELERYBEAT_SCHEDULE = {
     # http://docs.celeryproject.org/en/latest/reference/celery.schedules.html
     'sync_landing_page_data': {
         'task': 'sync_landing_page_data',
-        'schedule': timedelta(seconds=60 * 60 * 12),
+        'schedule': timedelta(seconds=60 * 10),  # only uploads if landing data changed
     },
     'sync_action_transparency': {
         'task': 'sync_action_transparency',
-        'schedule': timedelta(seconds=60 * 15),
+        'schedule': timedelta(seconds=60),
+    },
+    'sync_action_transparency_full': {
+        'task': 'sync_action_transparency',
+        'schedule': crontab(minute=0, hour=[2+5]),
+        'args': (True,),
+    },
+    'reconcile_action_image_count': {
+        'task': 'reconcile_action_image_count',
+        'schedule': crontab(minute=30, hour=[4+5]),
+    },
+    'sync_locality_action_count': {
+        'task': 'sync_locality_action_count',
+        'schedule': timedelta(seconds=60 * 60),
+    },
+    'sync_locality_search_index': {
+        'task': 'sync_locality_search_index',
+        'schedule': timedelta(seconds=60 * 5),
     },
 
     'sync_submissions': {
@@ -15,6 +15,8 @@ REST_FRAMEWORK = {
         # applies to all authenticated users, including w/ token auth, except admins
         'burst': '75/min',
         'search_burst': '120/min',
+        'autocomplete_burst': '300/min',  # requested on every keystroke
+        'map_tile_burst': '1200/min',  # each map pan or zoom requests dozens of tiles
         'authentication': '4/min',  # for users submitting username/email/password tuples to obtain token
     },
 }
@@ -14,6 +14,9 @@ MIDDLEWARE += [
 DEBUG = True
 DEBUG_PROPAGATE_EXCEPTIONS = True
 
+PROFILING = True
+QUERY_BUDGET_ENFORCE = True
+
 # shell_plus from django-extensions
 SHELL_PLUS_PRE_IMPORTS = (
     ('django.core.urlresolvers', ('resolve',)),
@@ -1,3 +1,4 @@
+import logging
 import os
 
 from django.core.wsgi import get_wsgi_application
@@ -8,3 +9,15 @@ from raven.contrib.django.raven_compat.middleware.wsgi import Sentry
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.development')
 
 application = Sentry(get_wsgi_application())
+
+from django.db import DatabaseError, connection  # noqa: E402
+from django_redis.exceptions import ConnectionInterrupted  # noqa: E402
+from api.search import warm_locality_index  # noqa: E402
+
+try:
+    warm_locality_index()
+except (DatabaseError, ConnectionInterrupted):  # e.g. DB isn't migrated yet, index is loaded on first request instead
+    logging.getLogger(__name__).exception('failed to warm locality index')
+finally:
+    # uWSGI forks workers after loading app, they mustn't share master's DB connection
+    connection.close()
@@ -1,6 +1,36 @@
+from collections import Counter
+from contextlib import contextmanager
+import threading
+
 from django.db import models
 
 
+_local = threading.local()
+
+# validation queries run and skipped by `BaseModel.save`, by model label, since process started
+validation_queries_run: Counter = Counter()
+validation_queries_skipped: Counter = Counter()
+
+
+@contextmanager
+def trusted_writes():
+    """Inside this block, `BaseModel.save` doesn't call `full_clean`, unless it's
+    called with `validate=True`. For internal jobs and loaders that write data
+    they produced themselves, so validation queries, e.g. for unique fields and
+    foreign keys, are wasted. API code shouldn't use it.
+    """
+    previous = getattr(_local, 'trusted', False)
+    _local.trusted = True
+    try:
+        yield
+    finally:
+        _local.trusted = previous
+
+
+def writes_trusted() -> bool:
+    return getattr(_local, 'trusted', False)
+
+
 class BaseModel(models.Model):
     """An abstract base class model that provides self-updating `created` and
     `modified` fields.
@@ -35,8 +65,31 @@ class BaseModel(models.Model):
     class Meta:
         abstract = True
 
-    def save(self, *args, **kwargs):
+    def count_validation_queries(self) -> int:
+        """Queries `full_clean` would run: one per unique check and per foreign
+        key, unless value is `None`.
+        """
+        unique_checks, date_checks = self._get_unique_checks()
+        count = sum(
+            1 for _, fields in unique_checks
+            if all(getattr(self, self._meta.get_field(f).attname) is not None for f in fields)
+        )
+        count += sum(1 for _, _, field, _ in date_checks if getattr(self, field) is not None)
+        count += sum(
+            1 for field in self._meta.concrete_fields
+            if (field.many_to_one or field.one_to_one) and getattr(self, field.attname) is not None
+        )
+        return count
+
+    def save(self, *args, validate=None, **kwargs):
         """https://stackoverflow.com/questions/4441539/why-doesnt-djangos-model-save-call-full-clean
+
+        Pass `validate=False`, or use `trusted_writes`, to skip `full_clean`.
         """
-        self.full_clean()
+        if validate is None:
+            validate = not writes_trusted()
+        counter = validation_queries_run if validate else validation_queries_skipped
+        counter[self._meta.label] += self.count_validation_queries()
+        if validate:
+            self.full_clean()
         return super().save(*args, **kwargs)
@@ -1,6 +1,9 @@
+-- created by migration `0102_locality_search_index`, this script recreates view and indexes by hand
 CREATE EXTENSION IF NOT EXISTS unaccent;
 
-CREATE MATERIALIZED VIEW IF NOT EXISTS locality_search_index AS
+DROP MATERIALIZED VIEW IF EXISTS locality_search_index;
+
+CREATE MATERIALIZED VIEW locality_search_index AS
 SELECT id,
        cvegeo,
        location,
@@ -13,7 +16,10 @@ SELECT id,
        setweight(to_tsvector('spanish', unaccent(state_name)), 'A') as document
 FROM map_locality;
 
-CREATE INDEX IF NOT EXISTS idx_fts_locality_search ON locality_search_index USING gin(document);
+-- unique index is required by `REFRESH MATERIALIZED VIEW CONCURRENTLY`
+CREATE UNIQUE INDEX idx_locality_search_id ON locality_search_index (id);
+CREATE INDEX idx_fts_locality_search ON locality_search_index USING gin(document);
+CREATE INDEX idx_fts_locality_search_has_data ON locality_search_index USING gin(document) WHERE has_data = true;
 
--- refresh index if new locality records are inserted: `REFRESH MATERIALIZED VIEW locality_search_index;`
--- drop view and index to recreate them: `DROP MATERIALIZED VIEW locality_search_index;`
+-- view is refreshed by `sync_locality_search_index` job after localities change, and by loaders;
+-- refresh it by hand without blocking searches: `REFRESH MATERIALIZED VIEW CONCURRENTLY locality_search_index;`
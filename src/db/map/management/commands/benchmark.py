@@ -0,0 +1,333 @@
+"""
+Benchmarks public endpoints and jobs against data in DB, e.g. data generated
+by `generate_synthetic`, and writes p50/p95 latency, queries, response size and
+peak memory of each to a JSON report. Also compares in-memory locality
+autocomplete with FTS locality search. Reports include git commit and dataset
+counts, and can be compared with a report from another commit.
+
+By default response caches are disabled, to measure views themselves.
+Command fails, after writing report, if an endpoint runs more queries than
+`query_budget` of its view.
+
+USAGE:
+python manage.py benchmark [--iterations <n>] [--cache] [--output <path>] [--compare <path>]
+python manage.py benchmark --endpoints localities actions --skip_jobs --skip_search
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from db.map.models import Locality, Establishment, Organization, Action, Submission, Donor, Donation
+from db.map.models import Testimonial, VolunteerOpportunity, EmailNotification
+from api.search import load_locality_index, tokenize
+from api.views.map import locality_list_search_query
+from jobs.files import sync_submissions_image_meta
+from jobs.maintenance import sync_action_transparency
+from jobs.notifications import notification_function_by_email_type
+
+
+def git_commit() -> str:
+    commit = os.getenv('CUSTOM_GIT_COMMIT_HASH')
+    if commit:
+        return commit
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+def first_id(model, **filters) -> Optional[int]:
+    return model.objects.filter(**filters).order_by('id').values_list('id', flat=True).first()
+
+
+def get_endpoints() -> List[str]:
+    """Paths of public `GET` endpoints in `api/urls.py`. Detail endpoints use
+    first published record, so same dataset always benchmarks same records.
+    """
+    action_id = first_id(Action, published=True)
+    locality_id = first_id(Locality, action_count__gt=0)
+    organization_id = first_id(Organization)
+    donor_id = first_id(Donor)
+    testimonial_id = first_id(Testimonial, published=True)
+    opportunity_id = first_id(VolunteerOpportunity, published=True)
+    search = Locality.objects.filter(pk=locality_id).values_list('name', flat=True).first() or 'san'
+
+    endpoints = [
+        '/api/',
+        '/api/landing/',
+        '/api/landing_metrics/',
+        '/api/states/',
+        '/api/municipalities/',
+        '/api/localities/',
+        '/api/localities/?stream=true',
+        '/api/localities/?format=columnar',
+        '/api/localities/?format=msgpack',
+        '/api/localities_with_actions/',
+        f'/api/localities_search/?search={search[:4]}',
+        f'/api/localities_autocomplete/?search={search[:4]}',
+        '/api/localities_clusters/?bbox=-118.5,14.5,-86.7,32.8&zoom=5',
+        '/api/localities_clusters/?bbox=-99.5,19,-98.8,19.7&zoom=11',
+        '/api/tiles/localities/5/7/14.mvt',
+        '/api/tiles/submissions/5/7/14.mvt',
+        '/api/tiles/establishments/12/920/1822.mvt',
+        '/api/establishments/',
+        f'/api/establishments/?locality_id={locality_id}',
+        '/api/actions/',
+        '/api/actions_cached/',
+        '/api/actions_mini/',
+        '/api/submissions/',
+        '/api/donations/',
+        '/api/donors/',
+        '/api/donors_mini/',
+        '/api/organizations/',
+        '/api/volunteer_opportunities/',
+        '/api/volunteer_opportunities_cached/',
+    ]
+    detail_endpoints = [
+        (locality_id, '/api/localities/{}/'),
+        (action_id, '/api/actions/{}/'),
+        (action_id, '/api/actions/{}/log/'),
+        (action_id, '/api/action_share/{}/'),
+        (organization_id, '/api/organizations/{}/'),
+        (donor_id, '/api/donors/{}/'),
+        (testimonial_id, '/api/testimonials/{}/'),
+        (opportunity_id, '/api/volunteer_opportunities/{}/'),
+    ]
+    return endpoints + [path.format(pk) for pk, path in detail_endpoints if pk is not None]
+
+
+def get_search_queries(n: int = 50) -> List[str]:
+    """Prefixes of locality names, like the ones typed into autocomplete.
+    """
+    names = Locality.objects.order_by('id').values_list('name', flat=True)[:n * 100:100]
+    return [name[:length] for name in names for length in (3, 6) if len(name) >= length]
+
+
+def search_sql(query: str) -> List[int]:
+    """Ids returned by FTS query of `LocalitySearch`, with every token matched as a prefix.
+    """
+    tokens = ' & '.join(f'{token}:*' for token in tokenize(query))
+    return [locality.id for locality in Locality.objects.raw(locality_list_search_query.format(''), [tokens])]
+
+
+def benchmark_search(queries: List[str], iterations: int) -> Dict[str, Any]:
+    """Compare in-memory `LocalityIndex` with FTS query of `LocalitySearch`,
+    and report share of top 10 results they have in common.
+    """
+    index = load_locality_index()
+    overlap = []
+    for query in queries:
+        sql = search_sql(query)[:10]
+        memory = [record.id for record in index.search(query)]
+        overlap.append(len(set(sql) & set(memory)) / (len(sql) or 1))
+
+    def run_sql():
+        for query in queries:
+            search_sql(query)
+        return {}
+
+    def run_memory():
+        for query in queries:
+            index.search(query)
+        return {}
+
+    return {
+        'queries': len(queries),
+        'sql': measure(run_sql, iterations),
+        'memory': measure(run_memory, iterations),
+        'mean_top_10_overlap': round(sum(overlap) / (len(overlap) or 1), 3),
+    }
+
+
+def send_email_notifications_dry() -> int:
+    """Like `send_email_notifications` plus `send_email_notification`, but
+    computes emails in-process without sending them or incrementing `sent`.
+    """
+    count = 0
+    for n in EmailNotification.objects.filter(done=False):
+        if n.should_send() and notification_function_by_email_type[n.email_type](n) is not None:
+            count += 1
+    return count
+
+
+def get_jobs() -> List[Tuple[str, Callable]]:
+    """Synthetic images are synced, so `sync_submissions_image_meta` only
+    measures checking them, and doesn't schedule any tasks.
+    """
+    return [
+        ('sync_action_transparency', lambda: sync_action_transparency(True)),
+        ('sync_submissions_image_meta', sync_submissions_image_meta),
+        ('send_email_notifications', send_email_notifications_dry),
+    ]
+
+
+def measure(run: Callable[[], Dict[str, Any]], iterations: int) -> Dict[str, Any]:
+    """Run once to warm up, then `iterations` times to measure latency and
+    queries, then once more with `tracemalloc` to measure peak memory, which
+    would otherwise slow down timed runs.
+    """
+    run()
+    timings: List[float] = []
+    queries: List[int] = []
+    result: Dict[str, Any] = {}
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            result = run()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(context.captured_queries))
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        **result,
+        'p50_ms': round(percentile(timings, 0.5), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        'queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def query_budget(path: str) -> Optional[int]:
+    """`query_budget` of view that serves `path`, looked up like `ProfilingMiddleware` does.
+    """
+    try:
+        view_func = resolve(path.split('?')[0]).func
+    except Resolver404:
+        return None
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    return getattr(view_class, 'query_budget', None)
+
+
+def request(client: Client, path: str) -> Dict[str, Any]:
+    response = client.get(path)
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    return {'status': response.status_code, 'bytes': len(content)}
+
+
+def run_job(job: Callable) -> Dict[str, Any]:
+    """Job's writes are rolled back, so every iteration does same work.
+    """
+    with transaction.atomic():
+        result = job()
+        transaction.set_rollback(True)
+    return {'result': result}
+
+
+def get_dataset() -> Dict[str, int]:
+    models = (Locality, Establishment, Organization, Action, Submission, Donor, Donation, Testimonial,
+              VolunteerOpportunity, EmailNotification)
+    return {model._meta.model_name: model.objects.count() for model in models}
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    lines = [f"compared with {baseline.get('commit') or 'baseline'}"]
+    for kind in ('endpoints', 'jobs'):
+        for name, current in report[kind].items():
+            previous = baseline.get(kind, {}).get(name)
+            if previous is None:
+                continue
+            change = (current['p50_ms'] - previous['p50_ms']) / (previous['p50_ms'] or 1) * 100
+            lines.append(
+                f"{name}: p50 {previous['p50_ms']} -> {current['p50_ms']}ms ({change:+.0f}%), "
+                f"queries {previous['queries']} -> {current['queries']}"
+            )
+    return lines
+
+
+class Command(BaseCommand):
+    help = 'Benchmark public endpoints and jobs, and write results to a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--cache', action='store_true', help='Keep response caches on')
+        parser.add_argument('--endpoints', nargs='*', help='Only benchmark paths containing one of these strings')
+        parser.add_argument('--skip_jobs', action='store_true')
+        parser.add_argument('--skip_search', action='store_true')
+        parser.add_argument('--output', type=str, default='benchmark.json')
+        parser.add_argument('--compare', type=str, help='Path of a report to compare results with')
+
+    def handle(self, *args, **options):
+        if settings.ENVIRONMENT == 'production':
+            raise CommandError("benchmarks can't be run in production")
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        report: Dict[str, Any] = {
+            'commit': git_commit(),
+            'created': timezone.now().isoformat(),
+            'iterations': options['iterations'],
+            'cache': options['cache'],
+            'dataset': get_dataset(),
+            'endpoints': {},
+            'jobs': {},
+            'search': {},
+        }
+
+        overrides: Dict[str, Any] = {'ALLOWED_HOSTS': ['*'], 'PROFILING': False, 'QUERY_BUDGET_ENFORCE': False}
+        if not options['cache']:
+            overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        endpoints = get_endpoints()
+        if options['endpoints']:
+            endpoints = [e for e in endpoints if any(s in e for s in options['endpoints'])]
+        with override_settings(**overrides):
+            client = Client()
+            for path in endpoints:
+                result = measure(lambda: request(client, path), options['iterations'])
+                result['query_budget'] = query_budget(path)
+                report['endpoints'][path] = result
+                self.stdout.write(f"{path}: {result['status']}, p50 {result['p50_ms']}ms, {result['queries']} queries")
+
+        if not options['skip_jobs']:
+            for name, job in get_jobs():
+                result = measure(lambda: run_job(job), options['iterations'])
+                report['jobs'][name] = result
+                self.stdout.write(f"{name}: p50 {result['p50_ms']}ms, {result['queries']} queries")
+
+        if not options['skip_search']:
+            report['search'] = benchmark_search(get_search_queries(), options['iterations'])
+            sql, memory = report['search']['sql'], report['search']['memory']
+            self.stdout.write(
+                f"search, {report['search']['queries']} queries: SQL p50 {sql['p50_ms']}ms, "
+                f"in-memory p50 {memory['p50_ms']}ms, top 10 overlap {report['search']['mean_top_10_overlap']}"
+            )
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        self.stdout.write(f"report written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            for line in compare(report, baseline):
+                self.stdout.write(line)
+
+        # anonymous client doesn't load session or user, so these are all view's queries
+        over_budget = [
+            f"{path}: {result['queries']} queries, budget is {result['query_budget']}"
+            for path, result in report['endpoints'].items()
+            if result['query_budget'] is not None and result['queries'] > result['query_budget']
+        ]
+        if over_budget:
+            raise CommandError('endpoints over query budget:\n' + '\n'.join(over_budget))
@@ -0,0 +1,91 @@
+"""
+Checks `create_action_log_records`: it writes log records for changed actions
+with one `bulk_create`, none for unchanged ones, and fetches previous values
+of actions without a snapshot with one extra query. Fixtures are rolled back.
+
+USAGE:
+python manage.py check_action_log
+"""
+from typing import Callable, List
+import uuid
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from db.map.models import Locality, Organization, Action, ActionLog, create_action_log_records
+
+
+def create_actions(n: int) -> List[int]:
+    """Uses `bulk_create`, so no log records are written for them.
+    """
+    tag = uuid.uuid4().hex[:8]
+    locality = Locality.objects.bulk_create([Locality(
+        cvegeo=f'check_{tag}', cvegeo_municipality='', cvegeo_state='', name=tag, municipality_name=tag,
+        state_name=tag, location=Point(-99.13, 19.43, srid=4326), meta={},
+    )])[0]
+    organization = Organization.objects.bulk_create([Organization(
+        secret_key=f'check.{tag}', sector='civil', name=f'check_{tag}', contact={},
+    )])[0]
+    actions = Action.objects.bulk_create([Action(
+        key=i + 1, organization=organization, locality=locality, action_type='check', desc='',
+    ) for i in range(n)])
+    return [action.id for action in actions]
+
+
+def check(name: str, actions: List[Action], change: Callable[[List[Action]], None],
+          expected_logs: int, expected_queries: int) -> List[str]:
+    """Returns errors, if any.
+    """
+    change(actions)
+    ids = [action.id for action in actions]
+    before = ActionLog.objects.filter(action_id__in=ids).count()
+    with CaptureQueriesContext(connection) as context:
+        create_action_log_records(actions)
+    logs = ActionLog.objects.filter(action_id__in=ids).count() - before
+    queries = len(context.captured_queries)
+
+    errors = []
+    if logs != expected_logs:
+        errors.append(f'{name}: {logs} log records written, expected {expected_logs}')
+    if queries != expected_queries:
+        errors.append(f'{name}: {queries} queries, expected {expected_queries}')
+    return errors
+
+
+def change_desc(n: int) -> Callable[[List[Action]], None]:
+    def change(actions):
+        for action in actions[:n]:
+            action.desc = f'{action.desc} changed'
+    return change
+
+
+def without_snapshot(ids: List[int]) -> List[Action]:
+    """Instances with values in DB that weren't loaded with `from_db`, like
+    ones built by code that changes actions with raw SQL.
+    """
+    return [Action(pk=a.pk, **a.get_action_field_values()) for a in Action.objects.filter(pk__in=ids).order_by('id')]
+
+
+class Command(BaseCommand):
+    help = 'Check that create_action_log_records writes only changed actions, in one bulk_create'
+
+    def handle(self, *args, **options):
+        errors: List[str] = []
+        with transaction.atomic():
+            ids = create_actions(3)
+            loaded = list(Action.objects.filter(pk__in=ids).order_by('id'))
+            errors += check('snapshot, 2 changed', loaded, change_desc(2), expected_logs=2, expected_queries=1)
+            errors += check('snapshot, none changed', loaded, change_desc(0), expected_logs=0, expected_queries=0)
+            errors += check('no snapshot, 1 changed', without_snapshot(ids), change_desc(1),
+                            expected_logs=1, expected_queries=2)
+            errors += check('no snapshot, none changed', without_snapshot(ids), change_desc(0),
+                            expected_logs=0, expected_queries=1)
+            transaction.set_rollback(True)
+
+        for error in errors:
+            self.stdout.write(error)
+        if errors:
+            raise CommandError(f'{len(errors)} checks failed')
+        self.stdout.write('action log records match')
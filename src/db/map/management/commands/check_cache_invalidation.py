@@ -0,0 +1,121 @@
+"""
+Checks that responses cached with `cache_page_versioned` change after a nested
+model they render is saved or deleted, i.e. that the route's resources include
+that model and that the model bumps its generation.
+
+Creates fixtures with `bulk_create`, so no emails or tasks are triggered, then
+changes them with `save` and `delete`, which bump generations on commit.
+Fixtures are deleted at the end. Requires a real cache backend.
+
+USAGE:
+python manage.py check_cache_invalidation
+"""
+from typing import Callable, List, Tuple
+import uuid
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from db.map.models import Locality, Organization, Action, Submission, Donor, Donation, VolunteerOpportunity
+from db.users.models import DonorUser
+
+
+class Fixtures:
+    def __init__(self):
+        tag = uuid.uuid4().hex[:8]
+        self.locality = Locality.objects.bulk_create([Locality(
+            cvegeo=f'check_{tag}', cvegeo_municipality='', cvegeo_state='', name=tag, municipality_name=tag,
+            state_name=tag, location=Point(-99.13, 19.43, srid=4326), meta={},
+        )])[0]
+        self.organization = Organization.objects.bulk_create([Organization(
+            secret_key=f'check.{tag}', sector='civil', name=f'check_{tag}', contact={},
+        )])[0]
+        self.donor = Donor.objects.bulk_create([Donor(name=f'check_{tag}', contact={})])[0]
+        self.action = Action.objects.bulk_create([Action(
+            key=1, organization=self.organization, locality=self.locality, action_type='check', desc='',
+            published=True,
+        )])[0]
+        Donation.objects.bulk_create([Donation(
+            action=self.action, donor=self.donor, approved_by_donor=True, approved_by_org=True,
+        )])
+        self.submission = Submission.objects.bulk_create([Submission(
+            organization=self.organization, action=self.action, source='brigada', data={}, images=[], published=True,
+        )])[0]
+        self.opportunities = VolunteerOpportunity.objects.bulk_create([VolunteerOpportunity(
+            action=self.action, position=f'check {i}', required_skills=[], desc='', location='anywhere', target=1,
+        ) for i in range(2)])
+        self.donor_user = DonorUser.objects.bulk_create([DonorUser(
+            donor=self.donor, email=f'check_{tag}@example.com', first_name='check', surnames='check',
+            is_active=False, set_password_token_created=timezone.now(),
+        )])[0]
+
+    def delete(self):
+        DonorUser.objects.filter(donor=self.donor).delete()
+        Action.objects.filter(pk=self.action.pk).delete()  # cascades to donations, submissions, opportunities
+        Donor.objects.filter(pk=self.donor.pk).delete()
+        Organization.objects.filter(pk=self.organization.pk).delete()
+        Locality.objects.filter(pk=self.locality.pk).delete()
+
+
+def unpublish(instance) -> None:
+    instance.published = False
+    instance.save(validate=False)
+
+
+def activate(user: DonorUser) -> None:
+    user.is_active = True
+    user.save(validate=False)
+
+
+def get_cases(f: Fixtures) -> List[Tuple[str, str, Callable[[], None]]]:
+    """Each case changes a different fixture, so changes don't depend on order
+    of cases having been cached.
+    """
+    return [
+        ('submission', f'/api/donations/?donor_id={f.donor.pk}', lambda: unpublish(f.submission)),
+        ('volunteeropportunity', f'/api/donations/?donor_id={f.donor.pk}', lambda: unpublish(f.opportunities[0])),
+        ('volunteeropportunity', f'/api/organizations/{f.organization.pk}/', lambda: unpublish(f.opportunities[1])),
+        ('donoruser', '/api/donors/?page_size=2000', lambda: activate(f.donor_user)),
+        ('donoruser', f'/api/donors/{f.donor.pk}/', lambda: f.donor_user.delete()),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Check that cached responses change when nested models they render change'
+
+    def handle(self, *args, **options):
+        if settings.ENVIRONMENT == 'production':
+            raise CommandError("checks can't be run in production")
+        if 'DummyCache' in settings.CACHES['default']['BACKEND']:
+            raise CommandError('a real cache backend is required')
+
+        fixtures = Fixtures()
+        failures = []
+        try:
+            with override_settings(ALLOWED_HOSTS=['*']):
+                client = Client()
+                # change that bumps no generation must not change cached response, else nothing is cached
+                path = f'/api/donors/{fixtures.donor.pk}/'
+                before = client.get(path).content
+                Donor.objects.filter(pk=fixtures.donor.pk).update(desc='check')
+                if client.get(path).content != before:
+                    raise CommandError(f'{path} is not cached')
+
+                for model, path, change in get_cases(fixtures):
+                    before = client.get(path)
+                    if before.status_code != 200:
+                        raise CommandError(f'{path} returned {before.status_code}')
+                    change()
+                    changed = client.get(path).content != before.content
+                    self.stdout.write(f"{path} after {model} change: {'changed' if changed else 'STALE'}")
+                    if not changed:
+                        failures.append(f'{path} ({model})')
+        finally:
+            fixtures.delete()
+
+        if failures:
+            raise CommandError(f'stale cached responses: {", ".join(failures)}')
+        self.stdout.write('all cached responses changed')
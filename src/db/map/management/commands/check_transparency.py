@@ -0,0 +1,114 @@
+"""
+Checks that transparency fields computed in DB by `jobs.maintenance.transparency_query`
+match the ones computed by `get_status_by_category`, `get_score` and `get_level`.
+
+USAGE:
+python manage.py check_transparency
+python manage.py check_transparency --fixtures <n> [--seed <n>]
+"""
+from typing import Any, Dict, List, Tuple
+import datetime
+import random
+import uuid
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from db.choices import ACTION_BENEFICIARIES_CRITERIA_CHOICES
+from db.map.models import Locality, Organization, Action, Testimonial, Donor, Donation
+from db.users.models import DonorUser
+from jobs.maintenance import get_transparency_actions, get_transparency, get_status_by_category, get_score, get_level
+
+
+def maybe(rng: random.Random, value: Any, empty: Any = '') -> Any:
+    return value if rng.random() < 0.5 else empty
+
+
+def create_fixtures(n: int, seed: int) -> List[int]:
+    """Create `n` actions with random combinations of fields, testimonials and
+    donations that transparency scoring depends on. Uses `bulk_create` so no
+    signals or notifications are triggered. Returns ids of actions.
+    """
+    rng = random.Random(seed)
+    tag = uuid.uuid4().hex[:8]
+    location = Point(-99.13, 19.43, srid=4326)
+
+    locality = Locality.objects.bulk_create([Locality(
+        cvegeo=f'check_{tag}', cvegeo_municipality='', cvegeo_state='', name=tag, municipality_name=tag,
+        state_name=tag, location=location, meta={},
+    )])[0]
+    organization = Organization.objects.bulk_create([Organization(
+        secret_key=f'check.{tag}', sector='civil', name=f'check_{tag}', contact={},
+    )])[0]
+    donors = Donor.objects.bulk_create([Donor(name=f'check_{tag}_{i}', contact={}) for i in range(10)])
+    DonorUser.objects.bulk_create([
+        DonorUser(donor=donor, email=f'check_{tag}_{i}@example.com', first_name='check', surnames='check')
+        for i, donor in enumerate(donors) if i % 2 == 0
+    ])
+
+    criteria = [c for c, _ in ACTION_BENEFICIARIES_CRITERIA_CHOICES]
+    start = datetime.date(2018, 1, 1)
+    actions = Action.objects.bulk_create([Action(
+        key=i + 1, organization=organization, locality=locality, action_type='check',
+        desc=maybe(rng, 'desc'), target=maybe(rng, rng.randint(0, 100), None),
+        unit_of_measurement=maybe(rng, 'units'), budget=rng.choice([None, 0, 0.5, 1000]),
+        beneficiaries_desc=maybe(rng, 'desc'), beneficiaries_criteria=rng.choice(criteria),
+        beneficiaries_criteria_desc=maybe(rng, 'desc'),
+        start_date=maybe(rng, start, None), end_date=maybe(rng, start, None),
+        image_count=rng.choice([0, 1, 9, 10, 25]), status_by_category=maybe(rng, {'discourse_post': True}, {}),
+    ) for i in range(n)])
+
+    testimonials, donations = [], []
+    for action in actions:
+        for _ in range(rng.randint(0, 3)):
+            testimonials.append(Testimonial(
+                action=action, location=location, video={}, recipients='', published=rng.random() < 0.7,
+            ))
+        for donor in rng.sample(donors, rng.randint(0, 3)):
+            donations.append(Donation(
+                action=action, donor=donor, approved_by_donor=rng.random() < 0.7, approved_by_org=rng.random() < 0.7,
+            ))
+    Testimonial.objects.bulk_create(testimonials)
+    Donation.objects.bulk_create(donations)
+    return [action.id for action in actions]
+
+
+def compare_transparency(action_ids=None) -> Tuple[int, List[Dict[str, Any]]]:
+    """Returns number of actions checked, and mismatches between Python and SQL.
+    """
+    expected = get_transparency(action_ids)
+    mismatches = []
+    count = 0
+    for action in get_transparency_actions(action_ids):
+        count += 1
+        status_by_category = {**action.status_by_category, **get_status_by_category(action, prefetched=True)}
+        python = (status_by_category, float(get_score(status_by_category)), get_level(status_by_category))
+        sql_status_by_category, sql_score, sql_level = expected.get(action.id, (None, None, None))
+        sql = (sql_status_by_category, None if sql_score is None else float(sql_score), sql_level)
+        if python != sql:
+            mismatches.append({'id': action.id, 'python': python, 'sql': sql})
+    return count, mismatches
+
+
+class Command(BaseCommand):
+    help = 'Check that SQL transparency scoring matches Python transparency scoring'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures', type=int, default=0,
+                            help='Check generated actions instead of existing ones, then roll them back')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for generated actions')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            action_ids = None
+            if options['fixtures'] > 0:
+                action_ids = create_fixtures(options['fixtures'], options['seed'])
+            count, mismatches = compare_transparency(action_ids)
+            transaction.set_rollback(True)
+
+        for mismatch in mismatches[:10]:
+            self.stdout.write(str(mismatch))
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} of {count} actions differ')
+        self.stdout.write(f'{count} actions match')
@@ -0,0 +1,323 @@
+"""
+Generates a synthetic national-scale dataset for benchmarks, into an empty DB.
+Same seed and counts always generate same data.
+
+DEPS:
+python manage.py loaddata scian_group.json
+
+USAGE:
+python manage.py generate_synthetic [--seed <n>] [--localities <n>] [--establishments <n>] [--actions <n>] ...
+"""
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+import csv
+import datetime
+import io
+import json
+import os
+import random
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from db.choices import ACTION_LABEL_BY_TYPE, ACTION_BENEFICIARIES_CRITERIA_CHOICES
+from db.choices import VOLUNTEER_OPPORTUNITY_LOCATION_CHOICES
+from db.map.models import Locality, Municipality, State, ScianGroup, Organization, EmailNotification, Action
+from db.map.models import ActionKeyCounter, Submission, Donor, Donation, Testimonial, VolunteerOpportunity
+from db.users.models import DonorUser
+from helpers.cache import bump_generation
+from jobs.maintenance import refresh_locality_search_index, sync_locality_action_count
+from jobs.maintenance import update_action_transparency, reconcile_action_image_count
+from .loaders import DENUE_FIELDS, batched, quote_columns
+
+
+SYLLABLES = ('san', 'ta', 'mi', 'gue', 'lo', 'pa', 'chi', 'co', 'xo', 'tla', 'te', 'pec', 'hua', 'ca', 'ma', 'ri')
+
+LOCALITY_COLUMNS = (
+    'created', 'modified', 'cvegeo', 'cvegeo_municipality', 'cvegeo_state', 'name', 'municipality_name', 'state_name',
+    'location', 'elevation', 'has_data', 'meta', 'action_count',
+)
+ESTABLISHMENT_COLUMNS = ('created', 'modified', 'cvegeo', 'scian_group_id', 'locality_id', 'location') + DENUE_FIELDS
+
+
+def copy_rows(cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]], not_null=()) -> None:
+    """Write rows with one `COPY`. Empty values are `NULL`, except in `not_null` columns.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    force_not_null = f', FORCE_NOT_NULL ({quote_columns(not_null)})' if not_null else ''
+    cursor.copy_expert(
+        f'COPY {table} ({quote_columns(columns)}) FROM STDIN WITH (FORMAT csv{force_not_null})', buffer,
+    )
+
+
+def random_name(rng: random.Random, syllables: int = 3) -> str:
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables)).title()
+
+
+def ewkt(lng: float, lat: float) -> str:
+    return f'SRID=4326;POINT({lng} {lat})'
+
+
+class Generator:
+    """Generates each table with bulk paths, `COPY` for largest ones and
+    `bulk_create` for the rest, so no signals or notifications are triggered.
+    """
+    def __init__(self, seed: int, batch_size: int, stdout):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.stdout = stdout
+        self.now = timezone.now()
+        self.bucket = os.getenv('CUSTOM_AWS_STORAGE_BUCKET_NAME')
+
+    def log(self, message: str) -> None:
+        self.stdout.write(f'{timezone.now().isoformat()} {message}')
+
+    def timestamp(self, i: int) -> str:
+        return (self.now - datetime.timedelta(seconds=i)).isoformat()
+
+    def point(self, lng: float, lat: float, spread: float = 0.05) -> Point:
+        rng = self.rng
+        return Point(lng + rng.uniform(-spread, spread), lat + rng.uniform(-spread, spread), srid=4326)
+
+    def localities(self, n: int) -> List[Tuple[int, float, float]]:
+        """States and municipalities are derived from localities, like INEGI data.
+        Synthetic cvegeos start with `X`, so they never collide with real ones.
+        """
+        rng = self.rng
+        states: Dict[str, str] = {}
+        municipalities: Dict[str, Tuple[str, str]] = {}
+        per_state = max(n // 32, 1)
+        per_municipality = max(per_state // 80, 1)
+
+        def rows():
+            for i in range(n):
+                state = f'X{"0123456789abcdefghijklmnopqrstuv"[min(i // per_state, 31)]}'
+                municipality = f'{state}{(i // per_municipality) % 1000:03d}'
+                cvegeo = f'{municipality}{i % 10000:04d}'
+                state_name = states.setdefault(state, random_name(rng, 4))
+                municipality_name = municipalities.setdefault(municipality, (random_name(rng), state_name))[0]
+                meta: Dict[str, Any] = {}
+                if rng.random() < 0.05:
+                    total = rng.randint(1, 500)
+                    destroyed = rng.randint(0, total)
+                    meta = {'total': total, 'destroyed': destroyed, 'habit': total - destroyed, 'notHabit': destroyed}
+                if rng.random() < 0.5:
+                    meta.update({'margIndex': rng.uniform(-2, 5), 'margGrade': rng.choice(['Bajo', 'Medio', 'Alto'])})
+                lng, lat = rng.uniform(-117, -87), rng.uniform(15, 32)
+                yield (
+                    self.timestamp(i), self.timestamp(i), cvegeo, municipality, state, random_name(rng),
+                    municipality_name, state_name, ewkt(lng, lat), rng.randint(0, 3000), bool(meta.get('total')),
+                    json.dumps(meta), 0,
+                )
+
+        with connection.cursor() as cursor:
+            for i, batch in enumerate(batched(rows(), self.batch_size)):
+                copy_rows(cursor, 'map_locality', LOCALITY_COLUMNS, batch)
+                self.log(f'{min((i + 1) * self.batch_size, n)} localities')
+            cursor.execute(
+                "SELECT id, ST_X(location), ST_Y(location) FROM map_locality WHERE cvegeo LIKE %s ORDER BY id", ['X%']
+            )
+            localities = cursor.fetchall()
+
+        Municipality.objects.bulk_create([
+            Municipality(cvegeo_municipality=cvegeo, cvegeo_state=cvegeo[:2], municipality_name=name, state_name=state)
+            for cvegeo, (name, state) in municipalities.items()
+        ], batch_size=self.batch_size)
+        State.objects.bulk_create([
+            State(cvegeo_state=cvegeo, state_name=name) for cvegeo, name in states.items()
+        ], batch_size=self.batch_size)
+        return localities
+
+    def establishments(self, n: int, localities: List[Tuple[int, float, float]]) -> None:
+        rng = self.rng
+        scian_group_ids = list(ScianGroup.objects.values_list('id', flat=True))
+        if not scian_group_ids:
+            raise CommandError('no scian groups, run `python manage.py loaddata scian_group.json` first')
+        text_columns = [c for c in ESTABLISHMENT_COLUMNS if c in DENUE_FIELDS or c == 'cvegeo']
+
+        def rows():
+            for i in range(n):
+                locality_id, lng, lat = rng.choice(localities)
+                values = {f: '' for f in DENUE_FIELDS}
+                lng, lat = lng + rng.uniform(-0.01, 0.01), lat + rng.uniform(-0.01, 0.01)
+                values.update({
+                    'denue_id': f'X{i}', 'nom_estab': random_name(rng, 4),
+                    'codigo_act': str(rng.randint(100000, 999999)),
+                    'per_ocu': rng.choice(['0 a 5 personas', '6 a 10 personas', '11 a 30 personas']),
+                    'latitud': str(lat), 'longitud': str(lng),
+                })
+                yield (
+                    self.timestamp(i), self.timestamp(i), '', rng.choice(scian_group_ids), locality_id, ewkt(lng, lat),
+                ) + tuple(values[f] for f in DENUE_FIELDS)
+
+        with connection.cursor() as cursor:
+            for i, batch in enumerate(batched(rows(), self.batch_size)):
+                copy_rows(cursor, 'map_establishment', ESTABLISHMENT_COLUMNS, batch, not_null=text_columns)
+                if (i + 1) % 10 == 0:
+                    self.log(f'{min((i + 1) * self.batch_size, n)} establishments')
+
+    def organizations(self, n: int) -> List[Organization]:
+        organizations = Organization.objects.bulk_create([
+            Organization(
+                secret_key=f'synthetic.{i}', sector=self.rng.choice(['civil', 'public', 'private', 'religious']),
+                name=f'Synthetic {random_name(self.rng)} {i}', desc=random_name(self.rng, 8) if i % 3 else '',
+                contact={},
+            ) for i in range(n)
+        ], batch_size=self.batch_size)
+        # same notifications `Organization.save` creates
+        notifications = (
+            ('organization_no_projects', 24*3, 24*7), ('organization_no_donations', 0, 24*6),
+            ('organization_no_photos', 0, 24*7),
+        )
+        EmailNotification.objects.bulk_create([
+            EmailNotification(
+                email_type=email_type, args={'organization_id': o.pk}, wait_hours=wait_hours,
+                period_hours=period_hours, target=2,
+            )
+            for o in organizations for email_type, wait_hours, period_hours in notifications
+        ], batch_size=self.batch_size)
+        return organizations
+
+    def actions(self, n: int, organizations: List[Organization], localities) -> List[Action]:
+        rng = self.rng
+        # actions are concentrated in a small share of localities, like in real data
+        affected = rng.sample(localities, max(len(localities) // 50, 1))
+        action_types = list(ACTION_LABEL_BY_TYPE)
+        criteria = [c for c, _ in ACTION_BENEFICIARIES_CRITERIA_CHOICES]
+        keys: Dict[int, int] = {}
+        actions = []
+        for i in range(n):
+            organization = rng.choice(organizations)
+            keys[organization.pk] = keys.get(organization.pk, 0) + 1
+            start = datetime.date(2017, 9, 19) + datetime.timedelta(days=rng.randint(0, 365))
+            actions.append(Action(
+                key=keys[organization.pk], organization=organization, locality_id=rng.choice(affected)[0],
+                action_type=rng.choice(action_types), desc=random_name(rng, 20) if rng.random() < 0.9 else '',
+                target=rng.choice([None, rng.randint(1, 1000)]), unit_of_measurement=rng.choice(['', 'casas']),
+                progress=rng.randint(0, 1000), budget=rng.choice([None, 0, rng.randint(10000, 10000000)]),
+                beneficiaries_desc=rng.choice(['', 'familias']), beneficiaries_criteria=rng.choice(criteria),
+                beneficiaries_criteria_desc=rng.choice(['', 'criterio']),
+                start_date=start if rng.random() < 0.8 else None,
+                end_date=start + datetime.timedelta(days=rng.randint(1, 365)) if rng.random() < 0.8 else None,
+                published=rng.random() < 0.9,
+            ))
+        actions = Action.objects.bulk_create(actions, batch_size=self.batch_size)
+        ActionKeyCounter.objects.bulk_create([
+            ActionKeyCounter(organization_id=organization_id, last_key=key) for organization_id, key in keys.items()
+        ], batch_size=self.batch_size)
+        return actions
+
+    def image(self, i: int, j: int) -> Dict[str, Any]:
+        width, height = self.rng.choice([(4032, 3024), (1920, 1080), (1280, 960)])
+        image = {
+            'url': f'https://{self.bucket}.s3.amazonaws.com/synthetic/{i}-{j}.jpg',
+            'exif': '{}', 'width': width, 'height': height, 'extension': 'jpg',
+        }
+        if self.rng.random() < 0.05:
+            image['hidden'] = True
+        return image
+
+    def submissions(self, n: int, actions: List[Action]) -> None:
+        rng = self.rng
+        submissions = []
+        for i in range(n):
+            action = rng.choice(actions)
+            submissions.append(Submission(
+                organization_id=action.organization_id, action=action, source='kobo', source_id=i,
+                location=self.point(-99.13, 19.43, 10), desc=random_name(rng, 10), data={},
+                images=[self.image(i, j) for j in range(rng.randint(0, 8))], published=rng.random() < 0.9,
+                submitted=self.now - datetime.timedelta(minutes=i),
+            ))
+            if len(submissions) == self.batch_size:
+                Submission.objects.bulk_create(submissions)
+                submissions = []
+        Submission.objects.bulk_create(submissions)
+
+    def donors(self, n: int, donations: int, actions: List[Action]) -> None:
+        rng = self.rng
+        donors = Donor.objects.bulk_create([
+            Donor(name=f'Synthetic donor {random_name(rng)} {i}', sector='private', contact={}, donating=i % 2 == 0)
+            for i in range(n)
+        ], batch_size=self.batch_size)
+        DonorUser.objects.bulk_create([
+            DonorUser(donor=donor, email=f'synthetic.donor.{i}@example.com', first_name='Synthetic', surnames='Donor')
+            for i, donor in enumerate(donors) if i % 4 == 0
+        ], batch_size=self.batch_size)
+        Donation.objects.bulk_create([
+            Donation(
+                action=rng.choice(actions), donor=rng.choice(donors), amount=rng.randint(1000, 1000000),
+                received_date=datetime.date(2018, 1, 1) + datetime.timedelta(days=rng.randint(0, 200)),
+                approved_by_donor=rng.random() < 0.8, approved_by_org=rng.random() < 0.8,
+            ) for _ in range(donations)
+        ], batch_size=self.batch_size)
+
+    def testimonials(self, n: int, actions: List[Action]) -> None:
+        rng = self.rng
+        Testimonial.objects.bulk_create([
+            Testimonial(
+                action=rng.choice(actions), location=self.point(-99.13, 19.43, 10), recipients='Ana, Luis',
+                video={'synced': True, 'youtube_video_id': f'synthetic{i}', 'url_thumbnail': '', 'url': ''},
+                published=rng.random() < 0.9,
+            ) for i in range(n)
+        ], batch_size=self.batch_size)
+
+    def opportunities(self, n: int, actions: List[Action]) -> None:
+        rng = self.rng
+        locations = [c for c, _ in VOLUNTEER_OPPORTUNITY_LOCATION_CHOICES]
+        VolunteerOpportunity.objects.bulk_create([
+            VolunteerOpportunity(
+                action=rng.choice(actions), position=random_name(rng), required_skills=['albañilería'],
+                desc=random_name(rng, 10), location=rng.choice(locations), target=rng.randint(1, 50),
+                published=rng.random() < 0.9,
+            ) for _ in range(n)
+        ], batch_size=self.batch_size)
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic dataset for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch_size', type=int, default=10000)
+        parser.add_argument('--localities', type=int, default=300000)
+        parser.add_argument('--establishments', type=int, default=2000000)
+        parser.add_argument('--organizations', type=int, default=500)
+        parser.add_argument('--actions', type=int, default=20000)
+        parser.add_argument('--submissions', type=int, default=50000)
+        parser.add_argument('--donors', type=int, default=2000)
+        parser.add_argument('--donations', type=int, default=20000)
+        parser.add_argument('--testimonials', type=int, default=2000)
+        parser.add_argument('--opportunities', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if settings.ENVIRONMENT == 'production':
+            raise CommandError("synthetic data can't be generated in production")
+        if Locality.objects.filter(cvegeo__startswith='X').exists():
+            raise CommandError('DB already has synthetic data')
+
+        generator = Generator(options['seed'], options['batch_size'], self.stdout)
+        with transaction.atomic():
+            localities = generator.localities(options['localities'])
+            generator.establishments(options['establishments'], localities)
+            organizations = generator.organizations(options['organizations'])
+            generator.log(f'{len(organizations)} organizations')
+            actions = generator.actions(options['actions'], organizations, localities)
+            generator.log(f'{len(actions)} actions')
+            generator.submissions(options['submissions'], actions)
+            generator.donors(options['donors'], options['donations'], actions)
+            generator.testimonials(options['testimonials'], actions)
+            generator.opportunities(options['opportunities'], actions)
+            generator.log('submissions, donors, donations, testimonials and opportunities')
+
+            # derived data maintained by jobs
+            reconcile_action_image_count()
+            sync_locality_action_count()
+            update_action_transparency()
+        refresh_locality_search_index()
+        bump_generation('locality', 'action', 'organization', 'submission', 'donation', 'donor', 'testimonial',
+                        'volunteeropportunity', 'establishment')
+        generator.log('done')
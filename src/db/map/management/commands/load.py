@@ -4,8 +4,10 @@ python manage.py loaddata scian_group.json
 
 USAGE:
 python manage.py load --load_dir <dir>
+python manage.py load --load_dir <dir> --bulk [--batch_size <n>]
 python manage.py load --denue_dir <dir>
 python manage.py load --denue_file <file>
+python manage.py load --denue_dir <dir> --bulk [--batch_size <n>] [--workers <n>] [--resume] [--dry_run]
 python manage.py load --locality_csv <file>
 python manage.py load --marg_csv <file>
 python manage.py load --donors
@@ -16,9 +18,11 @@ import csv
 
 from django.core.management.base import BaseCommand
 
+from db.config import trusted_writes, validation_queries_skipped
 from helpers.location import geos_location_from_coordinates
 from db.map.models import Locality, Municipality, State
-from .loaders import load_denue, load_donors, load_marg_data, reset_marg_data
+from .loaders import load_denue, load_denue_files, load_localities_bulk, print_denue_summary
+from .loaders import load_donors, load_marg_data, reset_marg_data
 
 
 def load_locality(row):
@@ -136,8 +140,22 @@ class Command(BaseCommand):
         parser.add_argument('--donors', action='store_true', help='Load default donors')
         parser.add_argument('--reset_marg', action='store_true',
                             help='Reset marg data, but not damage data, for all localities')
+        parser.add_argument('--bulk', action='store_true',
+                            help='Load locality and establishment records in batches, with bulk inserts')
+        parser.add_argument('--batch_size', type=int, default=5000, help='Rows per batch in bulk mode')
+        parser.add_argument('--workers', type=int, default=1, help='Processes for loading files in bulk mode')
+        parser.add_argument('--resume', action='store_true',
+                            help='Resume bulk load of establishment files from last checkpoint')
+        parser.add_argument('--dry_run', action='store_true',
+                            help='Report how many establishment records bulk load would change, without writing')
 
     def handle(self, *args, **options):
+        with trusted_writes():  # skip validation queries for each loaded row
+            self.load(**options)
+        if validation_queries_skipped:
+            print(f'validation queries skipped: {dict(validation_queries_skipped)}')
+
+    def load(self, **options):
         locality_csv = options.get('locality_csv')
         load_dir = options.get('load_dir')
         denue_dir = options.get('denue_dir')
@@ -145,14 +163,22 @@ class Command(BaseCommand):
         marg_csv = options.get('marg_csv')
         donors = options.get('donors')
         reset_marg = options.get('reset_marg')
+        bulk = options.get('bulk')
+        batch_size = options.get('batch_size')
+        workers = options.get('workers')
+        resume = options.get('resume')
+        dry_run = options.get('dry_run')
 
         if reset_marg:
-            reset_marg_data()
+            print(f'reset marg data for {reset_marg_data()} localities')
 
         if donors:
             load_donors()
 
-        if load_dir is not None:
+        if load_dir is not None and bulk:
+            print('bulk loading localities, municipalities and states')
+            print(load_localities_bulk(os.path.join(load_dir, 'locality.csv'), batch_size))
+        elif load_dir is not None:
             print('loading localities, municipalities and states')
             for source in ['locality', 'municipality', 'state']:
                 load_from_csv(os.path.join(load_dir, f'{source}.csv'), source)
@@ -161,18 +187,20 @@ class Command(BaseCommand):
             print('syncing locality features')
             sync_locality_features(locality_csv)
 
+        denue_files = []
         if denue_dir is not None:
-            print('syncing denue establishment data')
-            for f in os.listdir(denue_dir):
-                if not f.endswith('.csv'):
-                    continue
-                print(f)
-                load_from_csv(os.path.join(denue_dir, f), 'denue')
-
+            denue_files += [os.path.join(denue_dir, f) for f in sorted(os.listdir(denue_dir)) if f.endswith('.csv')]
         if denue_file is not None:
-            print(f'syncing denue establishment data: {denue_file}')
-            load_from_csv(denue_file, 'denue')
+            denue_files.append(denue_file)
+
+        if denue_files and bulk:
+            print(f'bulk syncing denue establishment data, {workers} worker(s){", dry run" if dry_run else ""}')
+            print_denue_summary(load_denue_files(denue_files, workers, batch_size, resume, dry_run))
+        else:
+            for f in denue_files:
+                print(f'syncing denue establishment data: {f}')
+                load_from_csv(f, 'denue')
 
         if marg_csv is not None:
             print(f'syncing social marg data: {marg_csv}')
-            load_marg_data(marg_csv)
+            print(f'updated {load_marg_data(marg_csv, batch_size)} localities')
@@ -1,58 +1,76 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import csv
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import time
 
-from db.map.models import Locality, Establishment, Donor
+from django.contrib.gis.geos import Point
+from django.db import connection, connections, transaction, DatabaseError
+
+from psycopg2.extras import execute_values
+
+from db.choices import SCIAN_GROUP_ID_BY_CODE
+from helpers.cache import bump_generation
+from db.map.models import Locality, Municipality, State, Establishment, Donor, LoadCheckpoint
+from jobs.maintenance import refresh_locality_search_index
 
 
 _denue_load_count = 0
+_locality_ids: Dict[str, int] = {}  # set in each bulk load worker by `init_denue_worker`
+
+DENUE_FIELDS = (
+    'denue_id',
+    'nom_estab',
+    'raz_social',
+    'codigo_act',
+    'nombre_act',
+    'per_ocu',
+    'tipo_vial',
+    'nom_vial',
+    'tipo_v_e_1',
+    'nom_v_e_1',
+    'tipo_v_e_2',
+    'nom_v_e_2',
+    'tipo_v_e_3',
+    'nom_v_e_3',
+    'numero_ext',
+    'letra_ext',
+    'edificio',
+    'edificio_e',
+    'numero_int',
+    'letra_int',
+    'tipo_asent',
+    'nomb_asent',
+    'tipoCenCom',
+    'nom_CenCom',
+    'num_local',
+    'cod_postal',
+    'cve_ent',
+    'entidad',
+    'cve_mun',
+    'municipio',
+    'cve_loc',
+    'localidad',
+    'ageb',
+    'manzana',
+    'telefono',
+    'correoelec',
+    'www',
+    'tipoUniEco',
+    'latitud',
+    'longitud',
+    'fecha_alta',
+)
 
 
 def load_denue(row):
     """Load denue row to DB.
     """
-    fields = (
-        'denue_id',
-        'nom_estab',
-        'raz_social',
-        'codigo_act',
-        'nombre_act',
-        'per_ocu',
-        'tipo_vial',
-        'nom_vial',
-        'tipo_v_e_1',
-        'nom_v_e_1',
-        'tipo_v_e_2',
-        'nom_v_e_2',
-        'tipo_v_e_3',
-        'nom_v_e_3',
-        'numero_ext',
-        'letra_ext',
-        'edificio',
-        'edificio_e',
-        'numero_int',
-        'letra_int',
-        'tipo_asent',
-        'nomb_asent',
-        'tipoCenCom',
-        'nom_CenCom',
-        'num_local',
-        'cod_postal',
-        'cve_ent',
-        'entidad',
-        'cve_mun',
-        'municipio',
-        'cve_loc',
-        'localidad',
-        'ageb',
-        'manzana',
-        'telefono',
-        'correoelec',
-        'www',
-        'tipoUniEco',
-        'latitud',
-        'longitud',
-        'fecha_alta',
-    )
-    values_dict = {k: v for k, v in zip(fields, row)}
+    values_dict = {k: v for k, v in zip(DENUE_FIELDS, row)}
     establishment = Establishment.objects.filter(denue_id=values_dict['denue_id']).first()
     if establishment is None:
         Establishment.objects.create(**values_dict)
@@ -63,6 +81,319 @@ def load_denue(row):
         print(_denue_load_count)
 
 
+# columns written by bulk loader, in `COPY` order; `created` and `modified` are set on merge
+DENUE_COLUMNS = ('cvegeo', 'scian_group_id', 'locality_id', 'location') + DENUE_FIELDS
+DENUE_COLUMN_TYPES = {'scian_group_id': 'integer', 'locality_id': 'integer', 'location': 'geometry(Point, 4326)'}
+
+
+def quote_columns(columns: Iterable[str]) -> str:
+    """DENUE has camel case columns, e.g. `tipoCenCom`, so identifiers must be quoted.
+    """
+    return ', '.join(f'"{c}"' for c in columns)
+
+
+denue_staging_query = 'CREATE TEMP TABLE denue_staging ({}) ON COMMIT DROP'.format(
+    ', '.join(f'"{c}" {DENUE_COLUMN_TYPES.get(c, "text")}' for c in DENUE_COLUMNS)
+)
+
+denue_copy_query = 'COPY denue_staging ({}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({}))'.format(
+    quote_columns(DENUE_COLUMNS), quote_columns(c for c in DENUE_COLUMNS if c not in DENUE_COLUMN_TYPES),
+)
+
+# `location` is derived from `latitud` and `longitud`, and geometry equality is fuzzy in older PostGIS
+DENUE_COMPARED_COLUMNS = tuple(c for c in DENUE_COLUMNS if c != 'location')
+
+denue_merge_query = """
+INSERT INTO map_establishment (created, modified, {columns})
+SELECT DISTINCT ON (denue_id) now(), now(), {columns} FROM denue_staging ORDER BY denue_id
+ON CONFLICT (denue_id) DO UPDATE SET modified = EXCLUDED.modified, {updates}
+WHERE ROW({existing}) IS DISTINCT FROM ROW({excluded})
+RETURNING (xmax = 0) AS inserted""".format(
+    columns=quote_columns(DENUE_COLUMNS),
+    updates=', '.join(f'"{c}" = EXCLUDED."{c}"' for c in DENUE_COLUMNS if c != 'denue_id'),
+    existing=', '.join(f'map_establishment."{c}"' for c in DENUE_COMPARED_COLUMNS),
+    excluded=', '.join(f'EXCLUDED."{c}"' for c in DENUE_COMPARED_COLUMNS),
+)
+
+denue_dry_run_query = """
+SELECT
+    COUNT(*) FILTER (WHERE e.id IS NULL),
+    COUNT(*) FILTER (WHERE e.id IS NOT NULL AND ROW({existing}) IS DISTINCT FROM ROW({staged}))
+FROM (SELECT DISTINCT ON (denue_id) * FROM denue_staging ORDER BY denue_id) s
+LEFT JOIN map_establishment e ON e.denue_id = s.denue_id""".format(
+    existing=', '.join(f'e."{c}"' for c in DENUE_COMPARED_COLUMNS),
+    staged=', '.join(f's."{c}"' for c in DENUE_COMPARED_COLUMNS),
+)
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_locality_ids() -> Dict[str, int]:
+    """Map of cvegeo -> locality id, built once so bulk loaders don't look up
+    localities row by row.
+    """
+    return dict(Locality.objects.values_list('cvegeo', 'id'))
+
+
+def denue_values(row: List[str], locality_ids: Dict[str, int]) -> Optional[Tuple]:
+    """Convert DENUE row to tuple of `DENUE_COLUMNS` values, resolving the same
+    fields as `Establishment.save`. Returns `None` for rows without location.
+    """
+    values = {k: v for k, v in zip(DENUE_FIELDS, row)}
+    try:
+        location = 'SRID=4326;POINT({} {})'.format(float(values['longitud']), float(values['latitud']))
+    except (KeyError, ValueError):
+        return None
+    cvegeo = ''.join(values.get(k, '').strip() for k in ('cve_ent', 'cve_mun', 'cve_loc'))
+    return (
+        cvegeo,
+        SCIAN_GROUP_ID_BY_CODE.get(values.get('codigo_act', ''), 1),
+        locality_ids.get(cvegeo),
+        location,
+        *(values.get(f, '') for f in DENUE_FIELDS),
+    )
+
+
+def read_csv_from_offset(csv_file: str, offset: int = 0) -> Iterator[Tuple[List[str], int]]:
+    """Yields (row, byte offset of end of row) pairs, starting from `offset`.
+    Header is skipped if reading from start of file.
+    """
+    position = offset
+
+    with open(csv_file, 'rb') as file:
+        file.seek(offset)
+
+        def lines():
+            nonlocal position
+            for line in file:
+                position += len(line)
+                yield line.decode('utf-8')
+
+        reader = csv.reader(lines(), lineterminator='\n')
+        if offset == 0:
+            next(reader, None)
+        for row in reader:
+            yield row, position
+
+
+def upsert_denue_batch(rows: List[Tuple], dry_run: bool = False) -> Tuple[int, int]:
+    """COPY rows into staging table, then merge them into `map_establishment`,
+    skipping rows that haven't changed. Returns (inserted, updated) counts.
+
+    If `dry_run` is true, counts rows that would be inserted or updated, then
+    rolls back.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    buffer.seek(0)
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(denue_staging_query)
+            cursor.copy_expert(denue_copy_query, buffer)
+            if dry_run:
+                cursor.execute(denue_dry_run_query)
+                inserted, updated = cursor.fetchone()
+                transaction.set_rollback(True)
+                return inserted, updated
+            cursor.execute(denue_merge_query)
+            results = cursor.fetchall()
+    inserted = sum(1 for r in results if r[0])
+    return inserted, len(results) - inserted
+
+
+def get_checkpoint(source: str, path: str, resume: bool, dry_run: bool = False) -> LoadCheckpoint:
+    """Get checkpoint for file. It's reset unless we're resuming a load of the
+    same version of the file. Dry runs never write checkpoints.
+    """
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    checkpoint = LoadCheckpoint.objects.filter(source=source, path=path).first()
+    if checkpoint is None:
+        checkpoint = LoadCheckpoint(source=source, path=path)
+    elif resume and checkpoint.matches(stat.st_size, stat.st_mtime):
+        return checkpoint
+
+    checkpoint.reset(stat.st_size, stat.st_mtime)
+    if not dry_run:
+        checkpoint.save()
+    return checkpoint
+
+
+def load_denue_bulk(
+    csv_file: str, locality_ids: Optional[Dict[str, int]] = None, batch_size: int = 5000,
+    resume: bool = False, dry_run: bool = False,
+) -> Dict[str, int]:
+    """Stream DENUE file in batches, upserting establishments with COPY instead
+    of a lookup and an insert per row.
+
+    Progress is checkpointed in the same transaction as each batch. With
+    `resume`, an interrupted load of an unchanged file picks up after the last
+    committed batch, and a finished one is skipped. Checkpoint stops advancing
+    at the first failed batch, so resuming retries it; merge is idempotent, so
+    batches after it that succeeded are just counted as unchanged.
+    """
+    if locality_ids is None:
+        locality_ids = get_locality_ids()
+    stats = {'read': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+    start = time.time()
+
+    checkpoint = get_checkpoint('denue', csv_file, resume, dry_run)
+    if checkpoint.done:
+        print(f'{csv_file}: already loaded, skipping')
+        return stats
+    if checkpoint.row_number > 0:
+        print(f'{csv_file}: resuming after row {checkpoint.row_number}')
+
+    batch_failed = False
+    for batch in batched(read_csv_from_offset(csv_file, checkpoint.byte_offset), batch_size):
+        rows = [values for values in (denue_values(row, locality_ids) for row, _ in batch) if values]
+        stats['read'] += len(batch)
+        stats['skipped'] += len(batch) - len(rows)
+        try:
+            with transaction.atomic():
+                inserted, updated = upsert_denue_batch(rows, dry_run) if rows else (0, 0)
+                if not dry_run and not batch_failed:
+                    checkpoint.byte_offset = batch[-1][1]
+                    checkpoint.row_number += len(batch)
+                    checkpoint.save()
+        except DatabaseError as e:  # batch was rolled back, keep going with the rest of the file
+            print(f'{csv_file}: batch failed, {e}')
+            if not dry_run:
+                checkpoint.refresh_from_db()
+            stats['failed'] += len(rows)
+            batch_failed = True
+        else:
+            stats['inserted'] += inserted
+            stats['updated'] += updated
+            stats['unchanged'] += len(rows) - inserted - updated
+        rate = stats['read'] / max(time.time() - start, 0.001)
+        print(f'{csv_file}: {stats["read"]} rows, {rate:.0f} rows/s')
+
+    if not dry_run and not batch_failed:
+        checkpoint.done = True
+        checkpoint.save()
+    if stats['inserted'] or stats['updated']:
+        bump_generation('establishment')
+    return stats
+
+
+def init_denue_worker(locality_ids: Dict[str, int]) -> None:
+    global _locality_ids
+    _locality_ids = locality_ids
+
+
+def load_denue_file(args: Tuple[str, int, bool, bool]) -> Dict:
+    """Runs in bulk load worker process. Never raises, so one bad file doesn't
+    abort the other workers.
+    """
+    csv_file, batch_size, resume, dry_run = args
+    start = time.time()
+    try:
+        stats: Dict = load_denue_bulk(csv_file, _locality_ids, batch_size, resume, dry_run)
+    except Exception as e:
+        stats = {'read': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0, 'error': str(e)}
+    stats['file'] = csv_file
+    stats['seconds'] = time.time() - start
+    return stats
+
+
+def load_denue_files(
+    csv_files: List[str], workers: int = 1, batch_size: int = 5000, resume: bool = False, dry_run: bool = False,
+) -> List[Dict]:
+    """Spread DENUE files across a pool of `workers` processes. Locality map is
+    built once and passed to each worker when it starts. Workers are forked,
+    because they inherit parent's Django setup; spawned workers would import
+    this module, and its models, before Django is set up. Each worker opens its
+    own DB connection.
+    """
+    locality_ids = get_locality_ids()
+    args = [(f, batch_size, resume, dry_run) for f in csv_files]
+    if workers <= 1:
+        init_denue_worker(locality_ids)
+        return [load_denue_file(a) for a in args]
+
+    connections.close_all()  # forked workers must not share parent's connection
+    context = multiprocessing.get_context('fork')
+    with context.Pool(workers, initializer=init_denue_worker, initargs=(locality_ids,)) as pool:
+        return pool.map(load_denue_file, args, chunksize=1)
+
+
+def print_denue_summary(results: List[Dict]) -> None:
+    keys = ('read', 'inserted', 'updated', 'unchanged', 'skipped', 'failed')
+    for r in results:
+        counts = ', '.join(f'{k}={r[k]}' for k in keys)
+        error = f', error={r["error"]}' if r.get('error') else ''
+        print(f'{r["file"]}: {counts}, seconds={r["seconds"]:.1f}{error}')
+    totals = ', '.join(f'{k}={sum(r[k] for r in results)}' for k in keys)
+    print(f'total: files={len(results)}, {totals}')
+
+
+def load_localities_bulk(csv_file: str, batch_size: int = 5000) -> Dict[str, int]:
+    """Insert localities missing from DB in chunks with `bulk_create`, deriving
+    municipalities and states from the same pass over the file. Existing keys
+    are preloaded into sets, so there's no lookup per row.
+
+    `bulk_create` skips `save`, so fields computed there are set here.
+    """
+    existing_localities = set(Locality.objects.values_list('cvegeo', flat=True))
+    existing_municipalities = set(Municipality.objects.values_list('cvegeo_municipality', flat=True))
+    existing_states = set(State.objects.values_list('cvegeo_state', flat=True))
+    municipalities: Dict[str, Municipality] = {}
+    states: Dict[str, State] = {}
+    stats = {'locality': 0, 'municipality': 0, 'state': 0}
+
+    with open(csv_file, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file, lineterminator='\n')
+        next(reader, None)
+        for batch in batched(reader, batch_size):
+            localities = []
+            for row in batch:
+                (cvegeo_state, state_name, cvegeo_municipality, municipality_name, cvegeo_locality, name,
+                    latitude, longitude, elevation, *rest) = row
+                cvegeo_state = cvegeo_state.strip()
+                cvegeo_municipality = cvegeo_state + cvegeo_municipality.strip()
+                cvegeo = cvegeo_municipality + cvegeo_locality.strip()
+
+                if cvegeo_state not in existing_states and cvegeo_state not in states:
+                    states[cvegeo_state] = State(cvegeo_state=cvegeo_state, state_name=state_name)
+                if cvegeo_municipality not in existing_municipalities and cvegeo_municipality not in municipalities:
+                    municipalities[cvegeo_municipality] = Municipality(
+                        cvegeo_municipality=cvegeo_municipality, municipality_name=municipality_name,
+                        cvegeo_state=cvegeo_municipality[:2], state_name=state_name,
+                    )
+                if cvegeo in existing_localities:
+                    continue
+                existing_localities.add(cvegeo)
+                localities.append(Locality(
+                    cvegeo=cvegeo, name=name,
+                    cvegeo_municipality=cvegeo[:5], municipality_name=municipality_name,
+                    cvegeo_state=cvegeo[:2], state_name=state_name,
+                    location=Point(float(longitude), float(latitude), srid=4326),
+                    elevation=float(elevation), has_data=False, meta={},
+                ))
+            Locality.objects.bulk_create(localities)
+            stats['locality'] += len(localities)
+            print(f'{csv_file}: {stats["locality"]} localities inserted')
+
+    Municipality.objects.bulk_create(municipalities.values(), batch_size=batch_size)
+    State.objects.bulk_create(states.values(), batch_size=batch_size)
+    stats['municipality'] = len(municipalities)
+    stats['state'] = len(states)
+
+    if stats['locality'] > 0:
+        refresh_locality_search_index()
+        bump_generation('locality')
+    return stats
+
+
 def load_donors():
     donors = [
         'Fundación Azteca', 'Takeda', 'Banorte', 'Fundación Checo Pérez', 'ENGIE',
@@ -77,68 +408,100 @@ def load_donors():
             pass
 
 
-def load_marg_data(file):
+# meta key and CSV column index of numeric CONEVAL columns
+MARG_NUMERIC_COLUMNS = (
+    ('analfabet', 7),
+    ('dropout', 8),
+    ('noPrimary', 9),
+    ('noHealth', 10),
+    ('dirtFloor', 11),
+    ('noToilet', 12),
+    ('noPlumb', 13),
+    ('noDrain', 14),
+    ('noElec', 15),
+    ('noWasher', 16),
+    ('noFridge', 17),
+    ('margIndex', 19),
+)
+
+# meta keys that hold damage data, as opposed to marg data
+DAMAGE_META_KEYS = ('destroyed', 'habit', 'notHabit', 'total')
+
+marg_update_query = """
+UPDATE map_locality SET meta = map_locality.meta || v.meta::jsonb, modified = now()
+FROM (VALUES %s) AS v (cvegeo, meta)
+WHERE map_locality.cvegeo = v.cvegeo"""
+
+reset_marg_query = """
+UPDATE map_locality SET modified = now(), meta = (
+    SELECT COALESCE(jsonb_object_agg(key, value), '{}'::jsonb)
+    FROM jsonb_each(map_locality.meta)
+    WHERE key IN %s
+)
+WHERE meta <> '{}'::jsonb"""
+
+
+def parse_float_column(values: Iterable[str]) -> Tuple[List[Optional[float]], List[int]]:
+    """Returns parsed column, and indices of values that aren't finite numbers.
+    """
+    parsed: List[Optional[float]] = []
+    invalid = []
+    for i, value in enumerate(values):
+        try:
+            number: Optional[float] = float(value)
+        except ValueError:
+            number = None
+        if number is None or not math.isfinite(number):
+            parsed.append(None)
+            invalid.append(i)
+        else:
+            parsed.append(number)
+    return parsed, invalid
+
+
+def load_marg_data(file: str, batch_size: int = 5000) -> int:
     """For loading CONEVAL "rezago social" data.
+
+    Parses whole file into columns, validates numeric columns together, then
+    merges marg data into `meta` of localities with one `UPDATE` per chunk.
+    `||` keeps damage keys already in `meta`.
     """
     with open(file, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f, delimiter=',', quotechar='"')
-        for i, row in enumerate(reader):
-            if i % 1000 == 0:
-                print(i)
-
-            clean = [e.strip() for e in row]
-            cvegeo = clean[1].rjust(9, '0')
-            analfabet = float(clean[7])
-            dropout = float(clean[8])
-            noPrimary = float(clean[9])
-            noHealth = float(clean[10])
-            dirtFloor = float(clean[11])
-            noToilet = float(clean[12])
-            noPlumb = float(clean[13])
-            noDrain = float(clean[14])
-            noElec = float(clean[15])
-            noWasher = float(clean[16])
-            noFridge = float(clean[17])
-            margIndex = float(clean[19])
-            margGrade = clean[20]
-
-            l = Locality.objects.filter(cvegeo=cvegeo).first()
-            if l is None:
-                continue
-            meta = {
-                **l.meta,
-                'analfabet': analfabet,
-                'dropout': dropout,
-                'noPrimary': noPrimary,
-                'noHealth': noHealth,
-                'dirtFloor': dirtFloor,
-                'noToilet': noToilet,
-                'noPlumb': noPlumb,
-                'noDrain': noDrain,
-                'noElec': noElec,
-                'noWasher': noWasher,
-                'noFridge': noFridge,
-                'margIndex': margIndex,
-                'margGrade': margGrade,
-            }
-            l.meta = meta
-            l.save()
-
-
-def reset_marg_data():
-    i = 0
-    for l in Locality.objects.all():
-        i += 1
-        if i % 1000 == 0:
-            print(i)
-
-        if not l.meta:
-            continue
-
-        meta = {}
-        attributes = ['destroyed', 'habit', 'notHabit', 'total']
-        for a in attributes:
-            if a in l.meta:
-                meta[a] = l.meta[a]
-        l.meta = meta
-        l.save()
+        rows = [[e.strip() for e in row] for row in csv.reader(f, delimiter=',', quotechar='"')]
+    if not rows:
+        return 0
+    columns = list(itertools.zip_longest(*rows, fillvalue=''))
+
+    invalid = set()
+    numeric = {}
+    for key, index in MARG_NUMERIC_COLUMNS:
+        numeric[key], invalid_rows = parse_float_column(columns[index])
+        invalid.update(invalid_rows)
+    if invalid:
+        print(f'skipping {len(invalid)} rows with invalid numbers, e.g. rows {sorted(invalid)[:10]}')
+
+    cvegeos = [c.rjust(9, '0') for c in columns[1]]
+    grades = columns[20]
+    values = [
+        (cvegeo, json.dumps({**{key: numeric[key][i] for key, _ in MARG_NUMERIC_COLUMNS}, 'margGrade': grades[i]}))
+        for i, cvegeo in enumerate(cvegeos) if i not in invalid
+    ]
+
+    updated = 0
+    with connection.cursor() as cursor:
+        for batch in batched(values, batch_size):
+            execute_values(cursor, marg_update_query, batch, page_size=len(batch))
+            updated += cursor.rowcount
+            print(f'{file}: {updated} localities updated')
+    bump_generation('locality')
+    return updated
+
+
+def reset_marg_data() -> int:
+    """Reset marg data, but not damage data, for all localities in one statement.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(reset_marg_query, [DAMAGE_META_KEYS])
+        reset = cursor.rowcount
+    bump_generation('locality')
+    return reset
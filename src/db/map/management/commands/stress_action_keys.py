@@ -0,0 +1,73 @@
+"""
+Creates actions in one organization from many threads at once, checks that
+`Action.key`s are unique and consecutive, then deletes everything it created.
+
+USAGE:
+python manage.py stress_action_keys [--threads <n>] [--actions <n>]
+"""
+from typing import List
+import threading
+import time
+import uuid
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from db.map.models import Locality, Organization, Action, ActionKeyCounter
+
+
+def create_actions(organization_id: int, locality_id: int, n: int, keys: List[int], errors: List[Exception]) -> None:
+    try:
+        for _ in range(n):
+            action = Action(organization_id=organization_id, locality_id=locality_id, action_type='stress', desc='')
+            action.save()
+            keys.append(action.key)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Create actions in one organization concurrently and check their keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=20)
+        parser.add_argument('--actions', type=int, default=10, help='Actions created by each thread')
+
+    def handle(self, *args, **options):
+        # `bulk_create` so no notifications are scheduled for organization
+        tag = uuid.uuid4().hex[:8]
+        organization = Organization.objects.bulk_create([Organization(
+            secret_key=f'stress.{tag}', sector='civil', name=f'stress_{tag}', contact={},
+        )])[0]
+        locality = Locality.objects.bulk_create([Locality(
+            cvegeo=f'stress_{tag}', cvegeo_municipality='', cvegeo_state='', name=tag, municipality_name=tag,
+            state_name=tag, location=Point(-99.13, 19.43, srid=4326), meta={},
+        )])[0]
+
+        keys: List[int] = []
+        errors: List[Exception] = []
+        args = (organization.id, locality.id, options['actions'], keys, errors)
+        threads = [threading.Thread(target=create_actions, args=args) for _ in range(options['threads'])]
+        start = time.time()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.time() - start
+        finally:
+            for action in Action.objects.filter(organization=organization):
+                action.delete()
+            ActionKeyCounter.objects.filter(organization=organization).delete()
+            Organization.objects.filter(pk=organization.pk).delete()
+            Locality.objects.filter(pk=locality.pk).delete()
+
+        expected = options['threads'] * options['actions']
+        self.stdout.write(f'{len(keys)} actions created in {seconds:.2f}s, {len(errors)} errors')
+        if errors:
+            raise CommandError(f'first error: {errors[0]!r}')
+        if sorted(keys) != list(range(1, expected + 1)):
+            raise CommandError(f'keys are not unique and consecutive: {sorted(keys)}')
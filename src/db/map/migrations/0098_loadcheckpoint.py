@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2018-07-30 17:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0097_auto_20180723_2313'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('modified', models.DateTimeField(auto_now=True, db_index=True)),
+                ('source', models.TextField()),
+                ('path', models.TextField()),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('byte_offset', models.BigIntegerField(blank=True, default=0)),
+                ('row_number', models.IntegerField(blank=True, default=0)),
+                ('done', models.BooleanField(blank=True, default=False)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='loadcheckpoint',
+            unique_together=set([('source', 'path')]),
+        ),
+    ]
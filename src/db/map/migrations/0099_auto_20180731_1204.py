@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2018-07-31 12:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0098_loadcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='establishment',
+            index=models.Index(fields=['-created', '-id'], name='map_establi_created_22aa1e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='action',
+            index=models.Index(fields=['-created', '-id'], name='map_action_created_01546c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['-submitted', '-id'], name='map_submiss_submitt_903c18_idx'),
+        ),
+    ]
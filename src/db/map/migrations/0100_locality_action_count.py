@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2018-08-01 10:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0099_auto_20180731_1204'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locality',
+            name='action_count',
+            field=models.IntegerField(
+                blank=True, default=0, help_text='Published actions, kept in sync by `update_locality_action_count`'),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE map_locality SET action_count = counts.action_count
+            FROM (
+                SELECT locality_id, COUNT(*) AS action_count FROM map_action WHERE published = true GROUP BY locality_id
+            ) AS counts
+            WHERE map_locality.id = counts.locality_id""",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX map_locality_listed_idx ON map_locality (id) WHERE has_data = true OR action_count > 0',
+            'DROP INDEX map_locality_listed_idx',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2018-08-02 16:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0100_locality_action_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActionKeyCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('modified', models.DateTimeField(auto_now=True, db_index=True)),
+                ('last_key', models.IntegerField(default=0)),
+                ('organization', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE, to='map.Organization')),
+            ],
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO map_actionkeycounter (created, modified, organization_id, last_key)
+            SELECT now(), now(), organization_id, MAX(key) FROM map_action GROUP BY organization_id""",
+            migrations.RunSQL.noop,
+        ),
+    ]
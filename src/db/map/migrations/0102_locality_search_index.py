@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2018-08-03 11:40
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Recreates `locality_search_index`, previously created by hand, with a
+    unique index so it can be refreshed concurrently.
+    """
+
+    dependencies = [
+        ('map', '0101_actionkeycounter'),
+    ]
+
+    operations = [
+        migrations.RunSQL('CREATE EXTENSION IF NOT EXISTS unaccent', migrations.RunSQL.noop),
+        migrations.RunSQL(
+            """
+            DROP MATERIALIZED VIEW IF EXISTS locality_search_index;
+
+            CREATE MATERIALIZED VIEW locality_search_index AS
+            SELECT id,
+                   cvegeo,
+                   location,
+                   name,
+                   municipality_name,
+                   state_name,
+                   has_data,
+                   setweight(to_tsvector('spanish', unaccent(name)), 'A') ||
+                   setweight(to_tsvector('spanish', unaccent(municipality_name)), 'B') ||
+                   setweight(to_tsvector('spanish', unaccent(state_name)), 'A') as document
+            FROM map_locality;
+
+            CREATE UNIQUE INDEX idx_locality_search_id ON locality_search_index (id);
+            CREATE INDEX idx_fts_locality_search ON locality_search_index USING gin(document);
+            CREATE INDEX idx_fts_locality_search_has_data ON locality_search_index USING gin(document)
+                WHERE has_data = true;""",
+            'DROP MATERIALIZED VIEW IF EXISTS locality_search_index',
+        ),
+    ]
@@ -1,9 +1,8 @@
+from typing import Any, Dict, Iterable, List, Optional
 import os
 
 from django.contrib.gis.db import models
-from django.db import transaction
-from django.db.models import Max
-from django.db.utils import IntegrityError
+from django.db import connection, transaction
 from django.utils import timezone
 from django.contrib.postgres.fields import JSONField, ArrayField
 from django.dispatch import receiver
@@ -16,6 +15,7 @@ from db.choices import ACTION_BENEFICIARIES_CRITERIA_CHOICES
 from helpers.location import geos_location_from_coordinates
 from helpers.diceware import diceware
 from helpers.datetime import timediff
+from helpers.cache import bump_generation, mark_dirty
 from jobs.messages import send_email, send_pretty_email
 
 
@@ -26,6 +26,9 @@ action_fields = [
 
 donation_fields = ['action', 'donor', 'amount', 'received_date', 'desc']
 
+DIRTY_ACTION_TRANSPARENCY = 'action_transparency'
+DIRTY_LOCALITY_SEARCH_INDEX = 'locality_search_index'
+
 
 class EmailNotification(BaseModel):
     email_type = models.TextField()
@@ -72,6 +75,34 @@ class AppVersion(BaseModel):
         ordering = ('-created',)
 
 
+class LoadCheckpoint(BaseModel):
+    """Progress of bulk load of a source file, so interrupted loads can resume.
+    `size` and `mtime` identify the version of the file that was being loaded.
+    """
+    source = models.TextField()
+    path = models.TextField()
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    byte_offset = models.BigIntegerField(default=0, blank=True)
+    row_number = models.IntegerField(default=0, blank=True)
+    done = models.BooleanField(default=False, blank=True)
+
+    REPR_FIELDS = ['source', 'path', 'row_number', 'done']
+
+    class Meta:
+        unique_together = ('source', 'path')
+
+    def matches(self, size, mtime):
+        return self.size == size and self.mtime == mtime
+
+    def reset(self, size, mtime):
+        self.size = size
+        self.mtime = mtime
+        self.byte_offset = 0
+        self.row_number = 0
+        self.done = False
+
+
 class Locality(BaseModel):
     """INEGI's "localidad". Loaded from external source.
     """
@@ -85,6 +116,8 @@ class Locality(BaseModel):
     elevation = models.FloatField(null=True, blank=True)
     has_data = models.BooleanField(blank=True, default=False, db_index=True, help_text='Has additional data')
     meta = JSONField(default={}, blank=True, help_text='Metrics, file URLs, etc')
+    action_count = models.IntegerField(
+        default=0, blank=True, help_text='Published actions, kept in sync by `update_locality_action_count`')
 
     REPR_FIELDS = ['cvegeo', 'name', 'municipality_name', 'state_name']
     STR_FIELDS = ['cvegeo', 'name', 'municipality_name', 'state_name']
@@ -165,6 +198,7 @@ class Establishment(BaseModel):
             models.Index(fields=['location']),
             models.Index(fields=['codigo_act']),
             models.Index(fields=['locality_id', 'scian_group_id']),
+            models.Index(fields=['-created', '-id']),
         ]
 
     def save(self, *args, **kwargs):
@@ -310,24 +344,45 @@ class Action(AbstractAction, BaseModel):  # type: ignore
     class Meta:
         unique_together = ('key', 'organization')
         ordering = ('-end_date', '-start_date', '-modified')
+        indexes = [
+            models.Index(fields=['-created', '-id']),
+        ]
+
+    _snapshot: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.take_snapshot()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.take_snapshot()
+
+    def get_action_field_values(self) -> Dict[str, Any]:
+        """Values of `action_fields`, keyed by attname, so FKs are compared and
+        copied by id without fetching related objects.
+        """
+        return {attname: getattr(self, attname) for attname in action_attnames()}
+
+    def take_snapshot(self) -> None:
+        """Remember values of `action_fields` as loaded from DB, so
+        `create_action_log_record` can tell if they changed without a query.
+        """
+        deferred = self.get_deferred_fields()
+        self._snapshot = None if deferred & set(action_attnames()) else self.get_action_field_values()
 
+    @transaction.atomic
     def save(self, *args, **kwargs):
         if self.pk is not None:
             return super().save(*args, **kwargs)
-        max_key = Action.objects.filter(organization=self.organization).aggregate(Max('key'))
-        self.key = (max_key.get('key__max') or 0) + 1
-        while True:
-            try:
-                return super().save(*args, **kwargs)
-            except IntegrityError as e:
-                self.key += 1
+        self.key = ActionKeyCounter.next_key(self.organization_id)
+        return super().save(*args, **kwargs)
 
     def action_label(self):
         return ACTION_LABEL_BY_TYPE.get(self.action_type, '')
 
-    def calculate_image_count(self):
-        return sum(len(s.synced_images(exclude_hidden=True)) for s in self.submission_set.filter(published=True))
-
     def synced_images(self, *args, **kwargs):
         images = [
             s.synced_images(*args, **kwargs) for s in self.submission_set.filter(published=True).order_by('-created')
@@ -335,6 +390,35 @@ class Action(AbstractAction, BaseModel):  # type: ignore
         return [image for s in images for image in s]
 
 
+action_key_query = """
+INSERT INTO map_actionkeycounter (created, modified, organization_id, last_key)
+VALUES (now(), now(), %(organization_id)s, COALESCE(
+    (SELECT MAX(key) FROM map_action WHERE organization_id = %(organization_id)s), 0
+) + 1)
+ON CONFLICT (organization_id) DO UPDATE SET last_key = map_actionkeycounter.last_key + 1, modified = now()
+RETURNING last_key"""
+
+
+class ActionKeyCounter(BaseModel):
+    """Last `Action.key` allocated in organization. Row is locked by transaction
+    that allocates a key until it commits, so concurrent creates in the same
+    organization get consecutive keys instead of conflicting.
+    """
+    organization = models.OneToOneField('Organization')
+    last_key = models.IntegerField(default=0)
+
+    REPR_FIELDS = ['organization_id', 'last_key']
+
+    @staticmethod
+    def next_key(organization_id) -> int:
+        """Allocate key with one statement, creating counter if organization
+        doesn't have one yet.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(action_key_query, {'organization_id': organization_id})
+            return cursor.fetchone()[0]
+
+
 class ActionLog(AbstractAction, BaseModel):  # type: ignore
     """Log that tracks state of `Action`s. Each time we read a record from action
     source (e.g. spreadsheet), we add another record to this table.
@@ -342,20 +426,80 @@ class ActionLog(AbstractAction, BaseModel):  # type: ignore
     action = models.ForeignKey('Action')
 
 
+def action_attnames() -> List[str]:
+    return [Action._meta.get_field(f).attname for f in action_fields]
+
+
 @receiver(models.signals.pre_save, sender=Action)
 def create_action_log_record(sender, instance, **kwargs):
     if instance.pk is None:
         return
-    old = Action.objects.get(pk=instance.pk)
-    if any(getattr(old, f) != getattr(instance, f) for f in action_fields):
-        ActionLog.objects.create(action=instance, **{f: getattr(instance, f) for f in action_fields})
+    previous = instance._snapshot
+    if previous is None:  # instance wasn't loaded from DB, or some action fields were deferred
+        previous = Action.objects.get(pk=instance.pk).get_action_field_values()
+    instance._previous_locality_id = previous['locality_id']
+    current = instance.get_action_field_values()
+    if previous != current:
+        ActionLog.objects.create(action=instance, **current)
 
 
 @receiver(models.signals.post_save, sender=Action)
 def create_first_action_log_record(sender, instance, created, **kwargs):
+    instance._snapshot = instance.get_action_field_values()
     if not created:
         return
-    ActionLog.objects.create(action=instance, **{f: getattr(instance, f) for f in action_fields})
+    ActionLog.objects.create(action=instance, **instance._snapshot)
+
+
+def create_action_log_records(actions: Iterable[Action]) -> List[ActionLog]:
+    """Batch version of `create_action_log_record`, for code that changes many
+    actions at once without calling `save`, e.g. with raw SQL. Call it with the
+    changed instances, in same transaction and before they're written: creates
+    log records with one `bulk_create` for actions whose `action_fields` differ
+    from their snapshot, and takes new snapshots. Previous values of actions
+    without a snapshot are fetched with one query.
+    """
+    actions = [action for action in actions if action.pk is not None]
+    missing = [action.pk for action in actions if action._snapshot is None]
+    previous_by_id = {
+        action.pk: action._snapshot for action in Action.objects.filter(pk__in=missing).only(*action_attnames())
+    } if missing else {}
+
+    logs = []
+    for action in actions:
+        previous = action._snapshot if action._snapshot is not None else previous_by_id.get(action.pk)
+        current = action.get_action_field_values()
+        if previous != current:
+            logs.append(ActionLog(action=action, **current))
+        action._snapshot = current
+    return ActionLog.objects.bulk_create(logs)
+
+
+locality_action_count_query = """
+UPDATE map_locality SET action_count = (
+    SELECT COUNT(*) FROM map_action WHERE map_action.locality_id = map_locality.id AND map_action.published = true
+)
+WHERE map_locality.id = ANY(%s)"""
+
+
+def update_locality_action_count(locality_ids) -> None:
+    """Recount published actions of localities in one statement.
+    """
+    locality_ids = [pk for pk in set(locality_ids) if pk is not None]
+    if not locality_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(locality_action_count_query, [locality_ids])
+
+
+@receiver(models.signals.post_save, sender=Action)
+def update_action_locality_action_count(sender, instance, **kwargs):
+    update_locality_action_count([instance.locality_id, getattr(instance, '_previous_locality_id', None)])
+
+
+@receiver(models.signals.post_delete, sender=Action)
+def update_deleted_action_locality_action_count(sender, instance, **kwargs):
+    update_locality_action_count([instance.locality_id])
 
 
 class Submission(BaseModel):
@@ -382,6 +526,7 @@ class Submission(BaseModel):
         indexes = [
             models.Index(fields=['location']),
             models.Index(fields=['submitted']),
+            models.Index(fields=['-submitted', '-id']),
         ]
 
     @property
@@ -410,20 +555,19 @@ class Submission(BaseModel):
         if self.action and self.action.organization != self.organization:
             self.action = None
 
-        old_action = None
+        old_action_id, old_image_count = None, 0
         created = self.pk is None
         if not created:
             old = Submission.objects.get(pk=self.pk)
-            old_action = old.action
-        new_action = self.action
+            old_action_id, old_image_count = old.action_id, old.counted_image_count()
 
         super().save(*args, **kwargs)
-        if old_action:
-            old_action.image_count = old_action.calculate_image_count()
-            old_action.save()
-        if new_action and new_action != old_action:
-            new_action.image_count = new_action.calculate_image_count()
-            new_action.save()
+        image_count = self.counted_image_count()
+        if old_action_id == self.action_id:
+            update_action_image_count(self.action_id, image_count - old_image_count, self.action)
+        else:
+            update_action_image_count(old_action_id, -old_image_count)
+            update_action_image_count(self.action_id, image_count, self.action)
 
         if created:
             if self.source == 'kobo':
@@ -431,6 +575,11 @@ class Submission(BaseModel):
             else:
                 sync_submission_image_meta.delay(self.pk)
 
+    def counted_image_count(self):
+        """Images this submission contributes to `Action.image_count`.
+        """
+        return len(self.synced_images(exclude_hidden=True)) if self.published else 0
+
     def synced_images(self, exclude_hidden=False):
         images = [i for i in self.images if i.get('hidden') is not True] if exclude_hidden else self.images
 
@@ -446,6 +595,30 @@ class Submission(BaseModel):
         return [prepare_image(i) for i in images if i['url'].startswith(f'https://{bucket}.s3.amazonaws.com')]
 
 
+def update_action_image_count(action_id, delta, action: Optional[Action] = None) -> None:
+    """Applies change in number of images of one of action's submissions, instead
+    of recounting images of all its submissions. Doesn't call `Action.save`, so
+    invalidates cached action data itself. `reconcile_action_image_count` job
+    fixes any drift.
+
+    `action`, if passed, is instance already loaded by caller, e.g.
+    `submission.action`; its `image_count` is refreshed, so saving it later
+    doesn't write stale value back.
+    """
+    if action_id is None or delta == 0:
+        return
+    Action.objects.filter(pk=action_id).update(image_count=models.F('image_count') + delta, modified=timezone.now())
+    if action is not None and action.pk == action_id:
+        action.refresh_from_db(fields=['image_count', 'modified'])
+    transaction.on_commit(lambda: mark_dirty(DIRTY_ACTION_TRANSPARENCY, [action_id]))
+    transaction.on_commit(lambda: bump_generation('action'))
+
+
+@receiver(models.signals.post_delete, sender=Submission)
+def update_deleted_submission_action_image_count(sender, instance, **kwargs):
+    update_action_image_count(instance.action_id, -instance.counted_image_count())
+
+
 class Testimonial(BaseModel):
     """Video testimonial of person benefitting from reconstruction `Action`.
     """
@@ -649,3 +822,57 @@ class Share(BaseModel):
     class Meta:
         unique_together = ('action', 'user')
         ordering = ('-created',)
+
+
+def bump_model_generation(sender, **kwargs):
+    """Invalidates cached API responses that depend on model. Waits for commit so
+    responses aren't cached again with data from before transaction.
+    """
+    resource = sender._meta.model_name
+    transaction.on_commit(lambda: bump_generation(resource))
+
+
+def connect_generation_receivers():
+    for model in (
+        Action, Submission, Donation, Organization, Donor, Testimonial, VolunteerOpportunity, Establishment, Locality,
+    ):
+        models.signals.post_save.connect(bump_model_generation, sender=model, dispatch_uid=f'{model.__name__}_save')
+        models.signals.post_delete.connect(
+            bump_model_generation, sender=model, dispatch_uid=f'{model.__name__}_delete')
+    # donor responses include whether donor has a user; lazy reference, `users` app imports nothing from `map`
+    models.signals.post_save.connect(bump_model_generation, sender='users.DonorUser', dispatch_uid='DonorUser_save')
+    models.signals.post_delete.connect(bump_model_generation, sender='users.DonorUser', dispatch_uid='DonorUser_delete')
+
+
+connect_generation_receivers()
+
+
+def mark_action_transparency_dirty(sender, instance, **kwargs):
+    """Actions whose transparency score must be recomputed by `sync_action_transparency`.
+    """
+    action_id = instance.pk if sender is Action else instance.action_id
+    if action_id is not None:
+        transaction.on_commit(lambda: mark_dirty(DIRTY_ACTION_TRANSPARENCY, [action_id]))
+
+
+def connect_transparency_receivers():
+    for model in (Action, Submission, Testimonial, Donation):
+        models.signals.post_save.connect(
+            mark_action_transparency_dirty, sender=model, dispatch_uid=f'{model.__name__}_transparency_save')
+        models.signals.post_delete.connect(
+            mark_action_transparency_dirty, sender=model, dispatch_uid=f'{model.__name__}_transparency_delete')
+
+
+connect_transparency_receivers()
+
+
+def mark_locality_search_index_dirty(sender, instance, **kwargs):
+    """Localities changed since `locality_search_index` was refreshed by `sync_locality_search_index`.
+    """
+    locality_id = instance.pk
+    transaction.on_commit(lambda: mark_dirty(DIRTY_LOCALITY_SEARCH_INDEX, [locality_id]))
+
+
+models.signals.post_save.connect(mark_locality_search_index_dirty, sender=Locality, dispatch_uid='Locality_search_save')
+models.signals.post_delete.connect(
+    mark_locality_search_index_dirty, sender=Locality, dispatch_uid='Locality_search_delete')
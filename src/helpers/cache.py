@@ -0,0 +1,63 @@
+from typing import Iterable, List, Set
+import time
+import uuid
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+
+def generation_key(resource: str) -> str:
+    return f'generation:{resource}'
+
+
+def get_generations(resources: Iterable[str]) -> List[int]:
+    """Current generation of each resource. Missing generations are initialized
+    to current time, so a generation evicted from cache never repeats an old one.
+    """
+    keys = [generation_key(r) for r in resources]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, int(time.time()), None)
+            generations[key] = cache.get(key, 0)
+    return [generations[key] for key in keys]
+
+
+def bump_generation(*resources: str) -> None:
+    """Invalidate everything cached under previous generation of `resources`.
+    """
+    for resource in resources:
+        key = generation_key(resource)
+        try:
+            cache.incr(key)
+        except ValueError:  # generation doesn't exist yet
+            cache.set(key, int(time.time()), None)
+
+
+def dirty_key(name: str) -> str:
+    return cache.make_key(f'dirty:{name}')
+
+
+def mark_dirty(name: str, ids: Iterable[int]) -> None:
+    """Add `ids` to Redis set `name`, for a job to process later with `pop_dirty`.
+    """
+    ids = list(ids)
+    if ids:
+        get_redis_connection('default').sadd(dirty_key(name), *ids)
+
+
+def pop_dirty(name: str) -> Set[int]:
+    """Atomically take all ids from Redis set `name`. Ids marked while caller
+    processes these ones go into a new set.
+    """
+    redis = get_redis_connection('default')
+    key = dirty_key(name)
+    taken = f'{key}:{uuid.uuid4().hex}'
+    try:
+        redis.rename(key, taken)
+    except ResponseError:  # set doesn't exist
+        return set()
+    ids = {int(i) for i in redis.smembers(taken)}
+    redis.delete(taken)
+    return ids
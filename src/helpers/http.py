@@ -45,10 +45,14 @@ def download_file(url: str, dest: str, raise_exception=True) -> Optional[str]:
 
 
 def get_s3_client():
+    """`CUSTOM_AWS_S3_ENDPOINT_URL` points client at an S3-compatible server,
+    e.g. minio or moto server in development.
+    """
     return boto3.client(
         's3',
         aws_access_key_id=os.getenv('CUSTOM_AWS_ACCESS_KEY'),
         aws_secret_access_key=os.getenv('CUSTOM_AWS_SECRET_KEY'),
+        endpoint_url=os.getenv('CUSTOM_AWS_S3_ENDPOINT_URL') or None,
     )
 
 
@@ -0,0 +1,68 @@
+from typing import List, Tuple
+from math import atan, sinh, pi, degrees, radians, log, tan, cos, floor
+
+from helpers.math import constrain
+
+
+MAX_ZOOM = 20
+MAX_LATITUDE = 85.0511  # web mercator doesn't cover poles
+MERCATOR_MAX = 20037508.342789244
+
+Bounds = Tuple[float, float, float, float]
+
+
+def tile_bounds(z: int, x: int, y: int) -> Bounds:
+    """West, south, east and north edges of XYZ (slippy map) tile, in degrees.
+    """
+    n = 2 ** z
+    north = degrees(atan(sinh(pi * (1 - 2 * y / n))))
+    south = degrees(atan(sinh(pi * (1 - 2 * (y + 1) / n))))
+    return x / n * 360 - 180, south, (x + 1) / n * 360 - 180, north
+
+
+def tile_bounds_mercator(z: int, x: int, y: int) -> Bounds:
+    """West, south, east and north edges of XYZ tile, in web mercator (EPSG:3857) meters.
+    """
+    size = 2 * MERCATOR_MAX / 2 ** z
+    west, north = -MERCATOR_MAX + x * size, MERCATOR_MAX - y * size
+    return west, north - size, west + size, north
+
+
+def lng_lat_to_tile(lng: float, lat: float, z: int) -> Tuple[int, int]:
+    n = 2 ** z
+    lat = constrain(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    x = floor((lng + 180) / 360 * n)
+    y = floor((1 - log(tan(radians(lat)) + 1 / cos(radians(lat))) / pi) / 2 * n)
+    return int(constrain(x, 0, n - 1)), int(constrain(y, 0, n - 1))
+
+
+def bbox_tiles(bbox: Bounds, z: int) -> List[Tuple[int, int]]:
+    """XYZ tiles at zoom `z` that intersect `bbox`.
+    """
+    west, south, east, north = bbox
+    x0, y0 = lng_lat_to_tile(west, north, z)
+    x1, y1 = lng_lat_to_tile(east, south, z)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def parse_bbox(value: str) -> Bounds:
+    """Parse `west,south,east,north` string, raising `ValueError` if it's invalid.
+    """
+    parts = [float(p) for p in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox must be west,south,east,north')
+    west, south, east, north = parts
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValueError('bbox is out of range')
+    return west, south, east, north
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def parse_zoom(value: str) -> int:
+    zoom = int(value)
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f'zoom must be between 0 and {MAX_ZOOM}')
+    return zoom
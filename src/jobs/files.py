@@ -88,7 +88,7 @@ def sync_submission_image_meta(submission_id):
         res = executor.map(get_image_meta, submission.images)
     submission.images = [i for i in res]
 
-    submission.save()
+    submission.save(validate=False)
 
 
 @shared_task(name='sync_testimonial_video_meta', default_retry_delay=30, max_retries=3)
@@ -132,7 +132,7 @@ def sync_testimonial_video_meta(testimonial_id):
             t.video['url_thumbnail'] = data['snippet']['thumbnails']['high']['url']
         except:
             pass
-        t.save()
+        t.save(validate=False)
 
     with transaction.atomic():
         testimonial = Testimonial.objects.select_for_update().get(id=testimonial_id)
@@ -173,4 +173,4 @@ def refresh_youtube_access_token():
     token.access_token = data['access_token']
     token.expires_in = data['expires_in']
     token.token_type = 'Bearer'
-    token.save()
+    token.save(validate=False)
@@ -115,7 +115,7 @@ def upload_submission_images(submission_id) -> Any:
         else:
             submission.images[i] = {'url': f'https://{bucket}.s3.amazonaws.com/{bucket_key}'}
     if save:
-        submission.save()
+        submission.save(validate=False)
         sync_submission_image_meta.delay(submission.id)
 
 
@@ -1,16 +1,22 @@
-from typing import Dict, Any
-import json
+from typing import Dict, Any, Iterable, Optional, Tuple
+from urllib.parse import urlparse
 import gzip
+import hashlib
+import io
+import os
 
+from django.core.cache import cache
 from django.db.models import Prefetch
-from django.db import transaction, connection
+from django.db import connection
+from django.http import HttpRequest
 from django.utils import timezone
 
 from celery import shared_task
-import requests
+from rest_framework.utils.encoders import JSONEncoder
 
-from helpers.http import get_s3_client, raise_for_status
-from db.map.models import Action, Donation, Testimonial
+from helpers.http import get_s3_client
+from helpers.cache import bump_generation, mark_dirty, pop_dirty
+from db.map.models import Action, Donation, Testimonial, DIRTY_ACTION_TRANSPARENCY, DIRTY_LOCALITY_SEARCH_INDEX
 
 
 def get_status_by_category(action, prefetched=False) -> Dict[str, Any]:
@@ -83,47 +89,287 @@ def get_level(status_by_category: Dict[str, Any]) -> int:
     return 3
 
 
-query = """
-UPDATE map_action SET modified = %s::timestamptz, status_by_category = %s, score = %s, level = %s WHERE id = %s"""
+def refresh_locality_search_index(concurrently: bool = True) -> bool:
+    """Refresh FTS materialized view created by migration `0102_locality_search_index`,
+    if it exists. Refreshing concurrently doesn't block searches, but is slower.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('locality_search_index')")
+        if cursor.fetchone()[0] is None:
+            return False
+        cursor.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}locality_search_index")
+    return True
+
+
+@shared_task(name='sync_locality_search_index')
+def sync_locality_search_index() -> bool:
+    """Refresh `locality_search_index` if localities changed since last run, see
+    `db.map.models.mark_locality_search_index_dirty`.
+    """
+    locality_ids = pop_dirty(DIRTY_LOCALITY_SEARCH_INDEX)
+    if not locality_ids:
+        return False
+    try:
+        return refresh_locality_search_index()
+    except Exception:
+        mark_dirty(DIRTY_LOCALITY_SEARCH_INDEX, locality_ids)
+        raise
+
+
+# same as `get_status_by_category`, `get_score` and `get_level`, for all actions or for actions in `%(ids)s`;
+# `check_transparency` management command checks results match
+transparency_query = """
+WITH status AS (
+    SELECT
+        a.id,
+        a.status_by_category AS previous,
+        a.desc <> '' AS "desc",
+        a.start_date IS NOT NULL AND a.end_date IS NOT NULL AS dates,
+        a.unit_of_measurement <> '' AND a.target IS NOT NULL AS progress,
+        COALESCE(a.budget <> 0, false) AS budget,
+        a.beneficiaries_desc <> '' AND CASE WHEN a.beneficiaries_criteria = 'other'
+            THEN a.beneficiaries_criteria_desc <> ''
+            ELSE a.beneficiaries_criteria <> ''
+        END AS beneficiaries,
+        a.image_count,
+        t.testimonials,
+        d.donations,
+        d.verified_donations
+    FROM map_action a
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS testimonials FROM map_testimonial WHERE action_id = a.id AND published = true
+    ) t
+    CROSS JOIN LATERAL (
+        SELECT
+            COUNT(*) AS donations,
+            COUNT(*) FILTER (
+                WHERE EXISTS (SELECT 1 FROM users_donoruser WHERE users_donoruser.donor_id = map_donation.donor_id)
+            ) AS verified_donations
+        FROM map_donation
+        WHERE action_id = a.id AND approved_by_donor = true AND approved_by_org = true
+    ) d
+    WHERE %(ids)s::integer[] IS NULL OR a.id = ANY(%(ids)s::integer[])
+)
+SELECT
+    id,
+    previous || jsonb_build_object(
+        'desc', "desc", 'dates', dates, 'progress', progress, 'budget', budget, 'beneficiaries', beneficiaries,
+        'image_count', image_count, 'testimonials', testimonials, 'donations', donations,
+        'verified_donations', verified_donations
+    ) AS status_by_category,
+    (image_count + testimonials * 5) * (
+        dates::int + progress::int + budget::int + beneficiaries::int +
+        (donations > 0)::int + (verified_donations > 0)::int
+    ) AS score,
+    CASE
+        WHEN NOT "desc" OR NOT progress OR NOT budget THEN 0
+        WHEN image_count < 10 AND testimonials < 2 THEN 1
+        WHEN NOT beneficiaries OR NOT dates THEN 2
+        ELSE 3
+    END AS level
+FROM status"""
+
+transparency_update_query = f"""
+UPDATE map_action SET
+    modified = now(), status_by_category = s.status_by_category, score = s.score, level = s.level
+FROM ({transparency_query}) AS s
+WHERE map_action.id = s.id AND (map_action.status_by_category, map_action.score, map_action.level)
+    IS DISTINCT FROM (s.status_by_category, s.score::double precision, s.level)"""
+
+
+def get_transparency_actions(action_ids: Optional[Iterable[int]] = None):
+    actions = Action.objects.prefetch_related(
+        Prefetch('testimonial_set', queryset=Testimonial.objects.filter(
+            published=True
+        ), to_attr='testimonials'),
+        Prefetch('donation_set', queryset=Donation.objects.filter(
+            approved_by_donor=True, approved_by_org=True
+        ), to_attr='donations'),
+        Prefetch('donation_set', queryset=Donation.objects.filter(
+            approved_by_donor=True, approved_by_org=True, donor__donoruser__isnull=False
+        ).distinct(), to_attr='verified_donations'),
+    )
+    if action_ids is not None:
+        actions = actions.filter(pk__in=list(action_ids))
+    return actions
+
+
+def get_transparency(action_ids: Optional[Iterable[int]] = None) -> Dict[int, Tuple[Dict[str, Any], float, int]]:
+    """Compute transparency fields in DB, without writing them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(transparency_query, {'ids': None if action_ids is None else list(action_ids)})
+        return {pk: (status_by_category, score, level) for pk, status_by_category, score, level in cursor.fetchall()}
+
+
+def update_action_transparency(action_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute transparency fields for actions in `action_ids`, or for all
+    actions if it's `None`, with one `UPDATE`. Only actions whose fields changed
+    are written.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(transparency_update_query, {'ids': None if action_ids is None else list(action_ids)})
+        return cursor.rowcount
 
 
 @shared_task(name='sync_action_transparency')
-def sync_action_transparency() -> None:
-    with transaction.atomic():
-        with connection.cursor() as cursor:
-            for action in Action.objects.prefetch_related(
-                Prefetch('testimonial_set', queryset=Testimonial.objects.filter(
-                    published=True
-                ), to_attr='testimonials'),
-                Prefetch('donation_set', queryset=Donation.objects.filter(
-                    approved_by_donor=True, approved_by_org=True
-                ), to_attr='donations'),
-                Prefetch('donation_set', queryset=Donation.objects.filter(
-                    approved_by_donor=True, approved_by_org=True, donor__donoruser__isnull=False
-                ).distinct(), to_attr='verified_donations'),
-            ):
-                status_by_category = {**action.status_by_category, **get_status_by_category(action, prefetched=True)}
-                score = get_score(status_by_category)
-                level = get_level(status_by_category)
-                cursor.execute(query, [
-                    timezone.now().isoformat(), json.dumps(status_by_category), score, level, action.id]
-                )
+def sync_action_transparency(full: bool = False) -> int:
+    """Recompute transparency fields of actions marked dirty since last run
+    (see `db.map.models.mark_action_transparency_dirty`), or of all actions if
+    `full` is passed.
+    """
+    action_ids = None if full else pop_dirty(DIRTY_ACTION_TRANSPARENCY)
+    if action_ids is not None and not action_ids:
+        return 0
+    try:
+        updated = update_action_transparency(action_ids)
+    except Exception:
+        if action_ids:
+            mark_dirty(DIRTY_ACTION_TRANSPARENCY, action_ids)
+        raise
+    if updated > 0:
+        bump_generation('action')
+    return updated
+
+
+sync_locality_action_count_query = """
+UPDATE map_locality SET action_count = counts.action_count
+FROM (
+    SELECT map_locality.id, COUNT(map_action.id) AS action_count
+    FROM map_locality
+    LEFT JOIN map_action ON map_action.locality_id = map_locality.id AND map_action.published = true
+    WHERE map_locality.action_count > 0 OR map_action.id IS NOT NULL
+    GROUP BY map_locality.id
+) AS counts
+WHERE map_locality.id = counts.id AND map_locality.action_count <> counts.action_count"""
+
+
+@shared_task(name='sync_locality_action_count')
+def sync_locality_action_count() -> int:
+    """Fix `Locality.action_count` for actions changed without calling `save`,
+    e.g. with `QuerySet.update`.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sync_locality_action_count_query)
+        updated = cursor.rowcount
+    if updated > 0:
+        bump_generation('locality')
+    return updated
+
+
+# `image` is an element of `map_submission.images` counted by `Submission.counted_image_count`, i.e. not
+# hidden and synced to bucket at `%(prefix)s` (see `synced_image_prefix`)
+counted_image_condition = """image -> 'hidden' IS DISTINCT FROM 'true'::jsonb
+    AND left(image ->> 'url', length(%(prefix)s)) = %(prefix)s"""
+
+
+def synced_image_prefix() -> str:
+    return f"https://{os.getenv('CUSTOM_AWS_STORAGE_BUCKET_NAME')}.s3.amazonaws.com"
+
+
+reconcile_action_image_count_query = f"""
+UPDATE map_action SET image_count = counts.image_count, modified = now()
+FROM (
+    SELECT map_action.id, COUNT(image) AS image_count
+    FROM map_action
+    LEFT JOIN map_submission ON map_submission.action_id = map_action.id AND map_submission.published = true
+    LEFT JOIN LATERAL jsonb_array_elements(map_submission.images) AS image ON {counted_image_condition}
+    GROUP BY map_action.id
+) AS counts
+WHERE map_action.id = counts.id AND map_action.image_count <> counts.image_count
+RETURNING map_action.id"""
+
+
+@shared_task(name='reconcile_action_image_count')
+def reconcile_action_image_count() -> int:
+    """Fix drift in `Action.image_count`, which is maintained with deltas by
+    `Submission.save`. Counts same images as `Submission.counted_image_count`.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(reconcile_action_image_count_query, {'prefix': synced_image_prefix()})
+        action_ids = [row[0] for row in cursor.fetchall()]
+    if action_ids:
+        mark_dirty(DIRTY_ACTION_TRANSPARENCY, action_ids)
+        bump_generation('action')
+    return len(action_ids)
+
+
+LANDING_BUCKET = 'brigada.mx'
+LANDING_KEY = 'landing_data.json'
+LANDING_MANIFEST_KEY = 'landing_data_manifest.json'
+LANDING_VERSION_KEY = 'landing_data/{}.json'
+LANDING_HASH_CACHE_KEY = 'landing_data_hash'
+
+
+def get_landing_data() -> Dict[str, Any]:
+    """Landing payload, computed in-process by `api.views.Landing`. Request
+    looks like it came through load balancer at `CUSTOM_API_URL`, so absolute
+    links in payload, e.g. `next`, are same as ones served by API.
+    """
+    from api.views import Landing
+
+    url = urlparse(os.getenv('CUSTOM_API_URL') or '')
+    scheme = url.scheme or 'https'
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = '/api/landing/'
+    request.META = {
+        'SERVER_NAME': url.hostname or 'localhost',
+        'SERVER_PORT': str(url.port or (443 if scheme == 'https' else 80)),
+        'HTTP_X_FORWARDED_PROTO': scheme,
+    }
+    return Landing.as_view()(request).data
+
+
+def compress_json(data: Any) -> Tuple[bytes, str]:
+    """Encode and gzip `data` one chunk at a time, and hash it while at it.
+    `mtime=0` makes output depend only on `data`. Returns compressed bytes and
+    SHA-256 of uncompressed JSON.
+    """
+    sha = hashlib.sha256()
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:
+        for chunk in JSONEncoder(ensure_ascii=False, separators=(',', ':')).iterencode(data):
+            encoded = chunk.encode()
+            sha.update(encoded)
+            f.write(encoded)
+    return buffer.getvalue(), sha.hexdigest()
+
+
+def upload_gzipped_json(s3, key: str, body: bytes, cache_control: str) -> None:
+    s3.upload_fileobj(io.BytesIO(body), LANDING_BUCKET, key, ExtraArgs={
+        'ACL': 'public-read',
+        'CacheControl': cache_control,
+        'ContentType': 'application/json',
+        'ContentEncoding': 'gzip',
+    })
 
 
 @shared_task(name='sync_landing_page_data', default_retry_delay=30, max_retries=3)
-def sync_landing_page_data() -> None:
-    data_file_path = '/tmp/landing_data.json.gz'
-    r = requests.get('https://api.brigada.mx/api/landing/')
-    raise_for_status(r)
+def sync_landing_page_data(force: bool = False) -> Optional[str]:
+    """Publish landing payload to S3 if it changed since it was last published.
 
-    with gzip.open(data_file_path, 'wb') as f:
-        f.write(bytes(json.dumps(r.json()), 'utf-8'))
+    Payload is uploaded to a key versioned by its hash, which can be cached
+    forever, and to `landing_data.json` for older clients. Manifest points to
+    current version and has a short `max-age`. Returns hash of payload if it
+    was published.
+    """
+    body, content_hash = compress_json(get_landing_data())
+    version = content_hash[:16]
+    if not force and cache.get(LANDING_HASH_CACHE_KEY) == content_hash:
+        return None
 
     s3 = get_s3_client()
-    with open(data_file_path, 'rb') as data:
-        s3.upload_fileobj(data, 'brigada.mx', 'landing_data.json', ExtraArgs={
-            'ACL': 'public-read',
-            'CacheControl': 'max-age=43200',
-            'ContentType': 'application/json',
-            'ContentEncoding': 'gzip',
-        })
+    key = LANDING_VERSION_KEY.format(version)
+    upload_gzipped_json(s3, key, body, 'max-age=31536000, immutable')
+    upload_gzipped_json(s3, LANDING_KEY, body, 'max-age=600')
+    manifest, _ = compress_json({
+        'version': version,
+        'key': key,
+        'sha256': content_hash,
+        'bytes': len(body),
+        'published': timezone.now().isoformat(),
+    })
+    upload_gzipped_json(s3, LANDING_MANIFEST_KEY, manifest, 'max-age=60')
+    cache.set(LANDING_HASH_CACHE_KEY, content_hash, None)
+    return content_hash